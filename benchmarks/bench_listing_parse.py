@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the parsing of attraction listing pages.
+
+Compares the original parse (a full html.parser tree) with AttractionScraper.parse_listing()
+using the installed backend (XPath on an lxml tree, or a partial BeautifulSoup tree of the
+listing cards). Pass saved listing pages as arguments, otherwise a synthetic page is used.
+
+    python benchmarks/bench_listing_parse.py [page.html ...]
+"""
+import os
+import sys
+from timeit import repeat
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tripscrape")
+)
+
+from bs4 import BeautifulSoup as bs
+
+from attractions import AttractionScraper
+from tripscrape import HTML_PARSER
+
+
+def make_page(cards=30, filler=3000):
+    """
+    Builds a synthetic listing page with the passed number of cards and filler elements.
+    """
+    card = (
+        '<div class="_25PvF8uO _2X44Y8hm"><div class="_2pZeTjmb">'
+        '<a href="/Attraction_Review-g186338-d{0}-Reviews-Attraction_{0}-London_England.html">'
+        '<img src="x.jpg"/></a></div><div><a class="_1QKQOve4" href="#">Attraction {0}</a>'
+        '<span class="_21qUqkJx">Sights &amp; Landmarks</span></div></div>'
+    )
+    noise = '<div class="x"><span class="y">text</span><a href="#">link</a></div>'
+    return "<html><head></head><body>{}{}{}</body></html>".format(
+        noise * (filler // 2),
+        "".join(card.format(187000 + i) for i in range(cards)),
+        noise * (filler // 2),
+    ).encode()
+
+
+def before(markup):
+    return [
+        (
+            div.find("div", {"class": "_2pZeTjmb"}).find("a").get("href"),
+            div.find("a", {"class": "_1QKQOve4"}).get_text(),
+            div.find("span", {"class": "_21qUqkJx"}).get_text(),
+        )
+        for div in bs(markup, "html.parser").find_all(
+            "div", {"class": "_25PvF8uO _2X44Y8hm"}
+        )
+    ]
+
+
+# parse_listing() uses neither the scraper's connection nor its session
+scraper = AttractionScraper.__new__(AttractionScraper)
+
+
+def after(markup):
+    return scraper.parse_listing(markup)
+
+
+def main():
+    if len(sys.argv) > 1:
+        pages = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [("synthetic", make_page())]
+
+    print("parser: {}".format(HTML_PARSER))
+    for name, markup in pages:
+        assert before(markup) == after(markup)
+        results = []
+        for f in (before, after):
+            results.append(min(repeat(lambda: f(markup), number=5, repeat=3)) / 5)
+        print(
+            "{} ({:.0f} KB): before {:.2f} ms, after {:.2f} ms ({:.1f}x)".format(
+                name,
+                len(markup) / 1024,
+                results[0] * 1000,
+                results[1] * 1000,
+                results[0] / results[1],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
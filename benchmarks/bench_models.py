@@ -0,0 +1,190 @@
+"""
+Micro-benchmark of the Review and User record types.
+
+Compares the original dict-backed classes with property pairs, built attribute by
+attribute and serialised with tuple(obj.__dict__.values()), with the slotted classes,
+built by reviews.read_reviews() and serialised with as_row(). Reports the time to build
+and serialise the rows of a page, the memory held per review and user, and the size of
+a pickled page (as sent from the parser processes of the pipelined scraper).
+
+    python benchmarks/bench_models.py [--reviews 500]
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import tracemalloc
+from timeit import repeat
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tripscrape")
+)
+
+from reviews import read_reviews
+
+
+class OldReview:
+    def __init__(
+        self,
+        ID=None,
+        title=None,
+        rating=None,
+        date=None,
+        full=None,
+        attr_ID=None,
+        user_profile=None,
+    ):
+        self._ID = ID
+        self._title = title
+        self._rating = rating
+        self._date = date
+        self._full = full
+        self._attr_ID = attr_ID
+        self._user_profile = user_profile
+
+    def _field(name):
+        return property(
+            lambda self: getattr(self, name),
+            lambda self, value: setattr(self, name, value),
+        )
+
+    ID = _field("_ID")
+    title = _field("_title")
+    rating = _field("_rating")
+    date = _field("_date")
+    full = _field("_full")
+    attr_ID = _field("_attr_ID")
+    user_profile = _field("_user_profile")
+
+
+class OldUser:
+    def __init__(
+        self, profile=None, location=None, contributions=None, helpful_votes=None
+    ):
+        self._profile = profile
+        self._location = location
+        self._contributions = contributions
+        self._helpful_votes = helpful_votes
+
+    _field = OldReview._field
+    profile = _field("_profile")
+    location = _field("_location")
+    contributions = _field("_contributions")
+    helpful_votes = _field("_helpful_votes")
+
+
+def make_reviews(n):
+    """
+    Builds a review list of n parsed review dicts like those of a __WEB_CONTEXT__.
+    """
+    return [
+        {
+            "id": 780000000 + i,
+            "title": "Review title {}".format(i),
+            "rating": 1 + i % 5,
+            "text": "Lorem ipsum dolor sit amet " * 20,
+            "publishedDate": "2021-01-{:02d}".format(1 + i % 28),
+            "userProfile": {
+                "route": {"url": "/Profile/user{}".format(i)},
+                "hometown": {"location": {"name": "London"}},
+                "contributionCounts": {"sumAllUgc": 10, "helpfulVote": 2},
+            },
+        }
+        for i in range(n)
+    ]
+
+
+def read_reviews_before(review_lists, attr_ID):
+    records = []
+    for reviews in review_lists:
+        for r in reviews:
+            review = OldReview()
+            user = OldUser()
+            review.ID = r["id"]
+            review.title = r["title"]
+            review.rating = r["rating"]
+            review.full = r["text"]
+            review.attr_ID = attr_ID
+            review.date = r["publishedDate"]
+            review.user_profile = r["userProfile"]["route"]["url"]
+            user.profile = review.user_profile
+            user.location = json.dumps(r["userProfile"]["hometown"])
+            user.contributions = r["userProfile"]["contributionCounts"]["sumAllUgc"]
+            user.helpful_votes = r["userProfile"]["contributionCounts"]["helpfulVote"]
+            records.append((review, user))
+    return records
+
+
+def rows_before(review_lists):
+    return [
+        (tuple(review.__dict__.values()), tuple(user.__dict__.values()))
+        for review, user in read_reviews_before(review_lists, 1)
+    ]
+
+
+def rows_after(review_lists):
+    return [
+        (review.as_row(), user.as_row())
+        for review, user in read_reviews(review_lists, 1)[0]
+    ]
+
+
+def allocated(f, review_lists):
+    # the review dicts and strings are shared, so only the record objects are measured
+    tracemalloc.start()
+    records = f(review_lists)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--reviews", type=int, default=500, help="the number of reviews per page"
+    )
+    args = parser.parse_args()
+
+    review_lists = [make_reviews(args.reviews)]
+    # the slotted reviews also carry the parsed published_date
+    assert rows_before(review_lists) == [
+        (review[:-1], user) for review, user in rows_after(review_lists)
+    ]
+
+    timings = [
+        min(repeat(lambda: f(review_lists), number=20, repeat=5)) / 20
+        for f in (rows_before, rows_after)
+    ]
+    print(
+        "build + rows of {} reviews: before {:.2f} ms, after {:.2f} ms ({:.1f}x)".format(
+            args.reviews,
+            timings[0] * 1000,
+            timings[1] * 1000,
+            timings[0] / timings[1],
+        )
+    )
+
+    memory = []
+    pickled = []
+    for f in (
+        read_reviews_before,
+        lambda review_lists, attr_ID: read_reviews(review_lists, attr_ID)[0],
+    ):
+        size, records = allocated(lambda r: f(r, 1), review_lists)
+        memory.append(size / args.reviews)
+        pickled.append(len(pickle.dumps(records)))
+    print(
+        "memory per review and user: before {:.0f} B, after {:.0f} B ({:.1f}x)".format(
+            memory[0], memory[1], memory[0] / memory[1]
+        )
+    )
+    print(
+        "pickled page: before {:.0f} KB, after {:.0f} KB".format(
+            pickled[0] / 1024, pickled[1] / 1024
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
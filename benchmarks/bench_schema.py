@@ -0,0 +1,245 @@
+"""
+Benchmark of the scrapers' queries before and after migration 005 (keys and indexes).
+
+Creates the schema in a throwaway PostgreSQL (with PostGIS) database from db_dump.sql and
+the migrations before 005, fills it with synthetic attractions, users and reviews, and
+times the queue reads, the refresh read, reviews by attraction, a spatial lookup and the
+batched upserts of reviews and users. Migration 005 alone (not the later migrations) is then
+applied and everything is timed again. All tables of the database are dropped first.
+
+    python benchmarks/bench_schema.py --dsn "dbname=tripscrape_bench user=postgres" [--reviews 10000000]
+
+Filling tens of millions of reviews takes a while and a few GB of disk.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "tripscrape"))
+
+import psycopg2 as db
+
+from migrate import MIGRATIONS_DIR, migrate
+from work_queue import WorkQueue
+from writer import BatchWriter
+
+INDEX_MIGRATION = "005_keys_and_indexes"
+ATTR_TYPES = ("Sights & Landmarks", "Museums", "Parks", "Tours")
+
+
+def apply_migrations(dsn, selected):
+    """
+    Applies the migrations whose file names are selected, by copying them to a temporary directory.
+
+    Parameters
+    ----------
+    dsn : str
+        the connection string of the database
+    selected : callable
+        a function taking a migration's file name and returning whether to apply it
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+            if selected(filename):
+                shutil.copy(os.path.join(MIGRATIONS_DIR, filename), directory)
+        conn = db.connect(dsn)
+        migrate(conn, directory)
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def create_schema(dsn):
+    """
+    Drops all tables and creates the schema of the migrations before 005.
+    """
+    conn = db.connect(dsn)
+    cur = conn.cursor()
+    cur.execute(
+        "DROP TABLE IF EXISTS public.attractions, public.reviews, public.users, public.schema_migrations CASCADE;"
+        "DROP SEQUENCE IF EXISTS public.attractions_serial_seq;"
+    )
+    with open(os.path.join(ROOT, "db_dump.sql")) as f:
+        cur.execute(f.read())
+    conn.commit()
+    conn.close()
+    apply_migrations(dsn, lambda filename: filename < INDEX_MIGRATION)
+
+
+def fill(dsn, attractions, users, reviews):
+    conn = db.connect(dsn)
+    cur = conn.cursor()
+    start = perf_counter()
+    cur.execute(
+        """INSERT INTO attractions (id, name, url, attr_type, scraped, geom)
+        SELECT i, 'Attraction ' || i, '/Attraction_Review-g186338-d' || i || '-Reviews-x.html',
+            (%s::varchar[])[1 + i %% 4], i %% 10 <> 0,
+            ST_SetSRID(ST_MakePoint(-0.5 + random(), 51.3 + random() / 2), 4326)
+        FROM generate_series(1, %s) i;""",
+        (list(ATTR_TYPES), attractions),
+    )
+    cur.execute(
+        """INSERT INTO users (profile, location, contributions, helpful_votes)
+        SELECT '/Profile/user' || i, '"London"', i %% 100, i %% 10 FROM generate_series(1, %s) i;""",
+        (users,),
+    )
+    cur.execute(
+        """INSERT INTO reviews (id, title, rating, date, "full", user_profile, attr_id)
+        SELECT i, 'Review ' || i, 1 + i %% 5, to_char(date '2010-01-01' + i %% 4000, 'YYYY-MM-DD'),
+            repeat('x', 100), '/Profile/user' || (1 + i %% %s), 1 + i %% %s
+        FROM generate_series(1, %s) i;""",
+        (users, attractions, reviews),
+    )
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE;")
+    conn.close()
+    print(
+        "Filled {} attractions, {} users and {} reviews in {:.0f} s".format(
+            attractions, users, reviews, perf_counter() - start
+        )
+    )
+
+
+def timed(f, repeat=20):
+    """
+    Returns the median of the run times of f in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        f()
+        times.append(perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def measure(dsn, attractions, users, reviews, migrated):
+    conn = db.connect(dsn)
+    cur = conn.cursor()
+    queue = WorkQueue(conn, worker_id="bench", attr_types=ATTR_TYPES[0])
+    writer = BatchWriter(conn, batch_size=10 ** 6, flush_interval=10 ** 6)
+    next_id = [reviews]
+
+    def query(sql, params=()):
+        def _run():
+            cur.execute(sql, params)
+            cur.fetchall()
+            conn.commit()
+
+        return _run
+
+    def claim():
+        row = queue.claim()
+        queue.release(row[0])
+
+    def upsert():
+        # 500 reviews and users per batch, half of the users already stored
+        for i in range(500):
+            next_id[0] += 1
+            profile = "/Profile/user{}".format(
+                next_id[0] if i % 2 else 1 + next_id[0] % users
+            )
+            row = (next_id[0], "t", 5, "2021-01-01", "x" * 100, 1, profile)
+            if migrated:
+                writer.add(
+                    """INSERT INTO reviews (ID, title, rating, date, "full", attr_ID, user_profile, published_date) VALUES %s ON CONFLICT DO NOTHING;""",
+                    row + (None,),
+                )
+            else:
+                writer.add(
+                    """INSERT INTO reviews (ID, title, rating, date, "full", attr_ID, user_profile) VALUES %s ON CONFLICT DO NOTHING;""",
+                    row,
+                )
+            writer.add(
+                """INSERT INTO users (profile, location, contributions, helpful_votes) VALUES %s ON CONFLICT DO NOTHING""",
+                (profile, '"London"', 1, 1),
+            )
+        writer.flush()
+
+    results = {
+        "read_attractions (100 rows)": timed(
+            query(
+                'SELECT id, url, last_offset FROM attractions WHERE scraped = False AND attr_type IN %s ORDER BY "id" DESC LIMIT 100',
+                ((ATTR_TYPES[0],),),
+            )
+        ),
+        "WorkQueue.claim + release": timed(claim),
+        "read_scraped_attractions (100 rows)": timed(
+            query(
+                "SELECT id, url, num_reviews FROM attractions WHERE scraped = True ORDER BY last_refreshed NULLS FIRST LIMIT 100"
+            )
+        ),
+        "reviews of an attraction": timed(
+            query("SELECT count(*) FROM reviews WHERE attr_id = %s", (attractions // 2,))
+        ),
+        "attractions within 500 m": timed(
+            query(
+                "SELECT count(*) FROM attractions WHERE ST_DWithin(geom, ST_SetSRID(ST_MakePoint(-0.1, 51.5), 4326), 0.005)"
+            )
+        ),
+        "upsert 500 reviews + 500 users": timed(upsert),
+    }
+    cur.execute(
+        "SELECT count(*) - count(DISTINCT profile) FROM users WHERE profile IN (SELECT user_profile FROM reviews WHERE id > %s);",
+        (reviews,),
+    )
+    duplicates = cur.fetchone()[0]
+    conn.commit()
+    conn.close()
+    return results, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--dsn", required=True, help="the connection string of a throwaway database"
+    )
+    parser.add_argument("--attractions", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=2_000_000)
+    parser.add_argument("--reviews", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    create_schema(args.dsn)
+    fill(args.dsn, args.attractions, args.users, args.reviews)
+    before, duplicates_before = measure(
+        args.dsn, args.attractions, args.users, args.reviews, migrated=False
+    )
+
+    # only 005, so that the later migrations' columns and indexes do not mix into the timings
+    start = perf_counter()
+    apply_migrations(args.dsn, lambda filename: filename.startswith(INDEX_MIGRATION))
+    conn = db.connect(args.dsn)
+    conn.autocommit = True
+    conn.cursor().execute("VACUUM ANALYZE;")
+    conn.close()
+    print("Applied {} in {:.0f} s".format(INDEX_MIGRATION, perf_counter() - start))
+    after, duplicates_after = measure(
+        args.dsn, args.attractions, args.users, args.reviews + 10 ** 6, migrated=True
+    )
+
+    for name in before:
+        print(
+            json.dumps(
+                {
+                    "query": name,
+                    "before ms": round(before[name], 2),
+                    "after ms": round(after[name], 2),
+                }
+            )
+        )
+    print(
+        "Duplicate users inserted by the upserts: before {}, after {}".format(
+            duplicates_before, duplicates_after
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
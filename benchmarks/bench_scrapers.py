@@ -0,0 +1,319 @@
+"""
+Offline throughput benchmark of the AttractionScraper and the ReviewScraper.
+
+Recorded TripAdvisor pages are replayed by a local stub server and the scraped rows are
+written to a throwaway PostgreSQL (with PostGIS) database, which is initialised from
+db_dump.sql and the migrations and emptied before every run. The rate control is
+effectively disabled, since the stub server does not need politeness delays.
+
+Record the pages once (needs network access):
+
+    python benchmarks/bench_scrapers.py record --place-id 186338 --attraction /Attraction_Review-g186338-d187547-Reviews-Tower_of_London-London_England.html
+
+and run the benchmark against them (needs no network access):
+
+    python benchmarks/bench_scrapers.py run --dsn "dbname=tripscrape_bench user=postgres"
+
+Requests for pages that were not recorded are answered with a recorded page of the same
+kind (attraction list or review page), so a few recorded pages are enough to replay a
+crawl of any size.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+from threading import Thread
+from time import perf_counter
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "tripscrape"))
+
+import psycopg2 as db
+
+from attractions import AttractionScraper
+from migrate import migrate
+from ratelimit import RateControl
+from reviews import ReviewScraper
+from tripscrape import make_session
+
+FIXTURES_DIR = os.path.join(ROOT, "benchmarks", "fixtures")
+UNLIMITED = dict(rate=1e9, max_rate=1e9, burst=1000)
+ATTRACTIONS_URL = "/Attractions-g{}-Activities-{}-a_allAttractions.true"
+
+
+def page_kind(path):
+    """
+    Returns the kind of a TripAdvisor page ("attractions", "reviews" or None) from its path.
+    """
+    if path.startswith("/Attractions-"):
+        return "attractions"
+    elif path.startswith("/Attraction_Review-"):
+        return "reviews"
+    return None
+
+
+def record(args):
+    """
+    Downloads the entry page of an attraction list and the first review pages of the passed attractions.
+    """
+    os.makedirs(args.fixtures, exist_ok=True)
+    index_path = os.path.join(args.fixtures, "index.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    session = make_session()
+    paths = [ATTRACTIONS_URL.format(args.place_id, "")] + args.attraction
+    for path in paths:
+        response = session.get("https://www.tripadvisor.com" + path, timeout=(10, 30))
+        response.raise_for_status()
+        filename = sha1(path.encode()).hexdigest() + ".html"
+        with open(os.path.join(args.fixtures, filename), "wb") as f:
+            f.write(response.content)
+        index[path] = filename
+        print("Recorded {} ({:.0f} KB)".format(path, len(response.content) / 1024))
+
+    with open(index_path, "w") as f:
+        json.dump(index, f, indent=2)
+
+
+def start_server(fixtures):
+    """
+    Starts a stub server replaying the recorded pages in a background thread.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        the running server
+    """
+    with open(os.path.join(fixtures, "index.json")) as f:
+        index = json.load(f)
+
+    pages = {}
+    by_kind = {}
+    for path, filename in index.items():
+        with open(os.path.join(fixtures, filename), "rb") as f:
+            pages[path] = f.read()
+        by_kind.setdefault(page_kind(path), pages[path])
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pages.get(self.path) or by_kind.get(page_kind(self.path))
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def reset_database(dsn):
+    """
+    Creates the schema in the throwaway database if necessary and empties all tables.
+    """
+    conn = db.connect(dsn)
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('public.attractions');")
+    if cur.fetchone()[0] is None:
+        with open(os.path.join(ROOT, "db_dump.sql")) as f:
+            cur.execute(f.read())
+        conn.commit()
+    migrate(conn)
+    cur.execute(
+        "TRUNCATE public.attractions, public.attraction_chunks, public.reviews, public.users;"
+    )
+    conn.commit()
+    conn.close()
+
+
+class Timings:
+    """
+    Accumulates the fetch and database time of a scraper and counts its pages and rows.
+    Replayed pages repeat the same ids, so rows are counted as they are passed to the
+    database rather than counted in the database.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.rows = 0
+        self.fetch = 0.0
+        self.db = 0.0
+
+    def instrument(self, scraper, update):
+        fetch = scraper.fetch
+        flush = scraper.writer.flush
+        update_row = getattr(scraper, update)
+
+        def timed_fetch(url):
+            start = perf_counter()
+            try:
+                return fetch(url)
+            finally:
+                self.fetch += perf_counter() - start
+                self.pages += 1
+
+        def timed_flush():
+            start = perf_counter()
+            try:
+                return flush()
+            finally:
+                self.db += perf_counter() - start
+
+        def counted_update(row):
+            self.rows += 1
+            return update_row(row)
+
+        scraper.fetch = timed_fetch
+        scraper.writer.flush = timed_flush
+        setattr(scraper, update, counted_update)
+
+
+def run_attractions(dsn, base_url, results):
+    conn = db.connect(dsn)
+    scraper = AttractionScraper(
+        db_conn=conn,
+        base_url=base_url + ATTRACTIONS_URL,
+        rate_control=RateControl(**UNLIMITED),
+    )
+    timings = Timings()
+    timings.instrument(scraper, "update_attraction")
+
+    start = perf_counter()
+    scraper.do_scrape()
+    scraper.close()
+    elapsed = perf_counter() - start
+    conn.close()
+    results.put(report("AttractionScraper", elapsed, timings))
+
+
+def run_reviews(dsn, base_url, limit, pages, results):
+    conn = db.connect(dsn)
+    conn_iter = db.connect(dsn)
+    cur = conn_iter.cursor()
+    cur.execute(
+        "UPDATE attractions SET scraped = (id NOT IN (SELECT id FROM attractions ORDER BY id LIMIT %s));",
+        (limit,),
+    )
+    conn_iter.commit()
+
+    scraper = ReviewScraper(
+        db_conn=conn,
+        db_iter_conn=conn_iter,
+        base_url=base_url,
+        attr_types="all",
+        rate_control=RateControl(**UNLIMITED),
+    )
+    get_attr_details = scraper.get_attr_details
+
+    def replayed_attr_details(url):
+        # the recorded review pages stand in for every page of every attraction
+        coords, num_reviews, num_pages = get_attr_details(url)
+        return coords, num_reviews, pages
+
+    scraper.get_attr_details = replayed_attr_details
+    timings = Timings()
+    timings.instrument(scraper, "update_review")
+
+    start = perf_counter()
+    scraper.do_scrape()
+    scraper.close()
+    elapsed = perf_counter() - start
+    conn.close()
+    conn_iter.close()
+    results.put(report("ReviewScraper", elapsed, timings))
+
+
+def report(name, elapsed, timings):
+    return {
+        "scraper": name,
+        "seconds": round(elapsed, 3),
+        "pages": timings.pages,
+        "rows": timings.rows,
+        "pages/s": round(timings.pages / elapsed, 2),
+        "rows/s": round(timings.rows / elapsed, 2),
+        "fetch s": round(timings.fetch, 3),
+        "db s": round(timings.db, 3),
+        "parse s": round(elapsed - timings.fetch - timings.db, 3),
+        "peak RSS MB": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def run(args):
+    server = start_server(args.fixtures)
+    base_url = "http://127.0.0.1:{}".format(server.server_address[1])
+    reset_database(args.dsn)
+
+    results = Queue()
+    for target, target_args in (
+        (run_attractions, (args.dsn, base_url, results)),
+        (run_reviews, (args.dsn, base_url, args.limit, args.pages, results)),
+    ):
+        # every scraper runs in its own process, so that the peak RSS is its own
+        p = Process(target=target, args=target_args)
+        p.start()
+        p.join()
+        if p.exitcode != 0:
+            server.shutdown()
+            sys.exit("{} failed".format(target.__name__))
+        print(json.dumps(results.get()))
+
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser(
+        "record", help="record pages from tripadvisor.com"
+    )
+    record_parser.add_argument("--place-id", type=int, default=186338)
+    record_parser.add_argument(
+        "--attraction",
+        action="append",
+        default=[],
+        help="the relative url of an attraction whose first review page is recorded",
+    )
+    record_parser.set_defaults(func=record)
+
+    run_parser = subparsers.add_parser("run", help="replay the recorded pages")
+    run_parser.add_argument(
+        "--dsn", required=True, help="the connection string of a throwaway database"
+    )
+    run_parser.add_argument(
+        "--limit",
+        type=int,
+        default=10,
+        help="the number of attractions whose reviews are scraped",
+    )
+    run_parser.add_argument(
+        "--pages",
+        type=int,
+        default=20,
+        help="the number of review pages scraped per attraction",
+    )
+    run_parser.set_defaults(func=run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
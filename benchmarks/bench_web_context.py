@@ -0,0 +1,127 @@
+"""
+Micro-benchmark of the __WEB_CONTEXT__ extraction of review pages.
+
+Compares the original extraction (regex search, global replace, json.loads and two
+walks with the recursive ReviewScraper.traverse) with web_context.parse() and
+web_context.find_reviews(). Pass saved review pages as arguments, otherwise a
+synthetic page of a similar size is used.
+
+    python benchmarks/bench_web_context.py [page.html ...]
+"""
+import json
+import os
+import re
+import sys
+from random import Random
+from timeit import repeat
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tripscrape")
+)
+
+import web_context
+
+
+def make_page(size=400_000, seed=0):
+    """
+    Builds a synthetic review page with a __WEB_CONTEXT__ of roughly the passed size in bytes.
+    """
+    rnd = Random(seed)
+    reviews = [
+        {
+            "id": 780000000 + i,
+            "title": "Review title {}".format(i),
+            "rating": rnd.randint(1, 5),
+            "text": "Lorem ipsum dolor sit amet " * 20,
+            "publishedDate": "2021-01-{:02d}".format(i + 1),
+            "userProfile": {
+                "route": {"url": "/Profile/user{}".format(i)},
+                "hometown": {"location": {"name": "London"}},
+                "contributionCounts": {"sumAllUgc": 10, "helpfulVote": 2},
+            },
+        }
+        for i in range(5)
+    ]
+    cache = {}
+    while len(json.dumps(cache)) < size:
+        key = "query{}".format(len(cache))
+        cache[key] = {
+            "data": {
+                "locations": [
+                    {
+                        "locationId": rnd.randint(1, 10 ** 6),
+                        "name": "x" * 40,
+                        "tags": list(range(20)),
+                    }
+                    for _ in range(10)
+                ]
+            }
+        }
+    cache["reviewList"] = {
+        "data": {
+            "locations": [
+                {"reviewListPage": {"totalCount": 5000, "reviews": reviews}}
+            ]
+        }
+    }
+    payload = json.dumps({"urqlCache": cache}, separators=(",", ":"))
+    context = "{pageManifest:" + payload + "}"
+    filler = "<div class='x'>" + "a" * 100 + "</div>\n"
+    script = "<script>window.__WEB_CONTEXT__={};(this.$WP=this.$WP||[]).push([]);</script>"
+    return "<html><head>{}{}</head><body>{}</body></html>".format(
+        filler * 500, script.format(context), filler * 500
+    )
+
+
+def traverse(val):
+    if isinstance(val, dict):
+        for k, v in val.items():
+            if k == "reviews":
+                yield v
+            else:
+                yield from traverse(v)
+    elif isinstance(val, list):
+        for v in val:
+            yield from traverse(v)
+
+
+def before(text):
+    data = re.search(r"window\.__WEB_CONTEXT__=(.*?});", text).group(1)
+    data = data.replace("pageManifest", '"pageManifest"')
+    data = json.loads(data)
+    next(traverse(data))
+    return list(traverse(data))
+
+
+def after(text):
+    return web_context.find_reviews(web_context.parse(text))
+
+
+def main():
+    if len(sys.argv) > 1:
+        pages = []
+        for path in sys.argv[1:]:
+            with open(path, encoding="utf-8") as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [("synthetic", make_page())]
+
+    print("backend: {}".format(web_context.loads.__module__))
+    for name, text in pages:
+        assert before(text) == after(text)
+        results = []
+        for f in (before, after):
+            results.append(min(repeat(lambda: f(text), number=20, repeat=5)) / 20)
+        print(
+            "{} ({:.0f} KB): before {:.2f} ms, after {:.2f} ms ({:.1f}x)".format(
+                name,
+                len(text) / 1024,
+                results[0] * 1000,
+                results[1] * 1000,
+                results[0] / results[1],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+-- Leases for claiming attractions from the work queue (see tripscrape/work_queue.py)
+
+ALTER TABLE public.attractions
+    ADD COLUMN IF NOT EXISTS lease_owner character varying,
+    ADD COLUMN IF NOT EXISTS lease_expires timestamp with time zone;
+
+ALTER TABLE ONLY public.attractions ALTER COLUMN scraped SET DEFAULT false;
+
+UPDATE public.attractions SET scraped = false WHERE scraped IS NULL;
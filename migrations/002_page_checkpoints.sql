@@ -0,0 +1,4 @@
+-- Offset of the last review page whose reviews are committed, used to resume interrupted attractions
+
+ALTER TABLE public.attractions
+    ADD COLUMN IF NOT EXISTS last_offset integer;
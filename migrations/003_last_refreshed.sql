@@ -0,0 +1,4 @@
+-- Time of the last refresh of an attraction's reviews (see ReviewScraper.do_refresh)
+
+ALTER TABLE public.attractions
+    ADD COLUMN IF NOT EXISTS last_refreshed timestamp with time zone;
@@ -0,0 +1,11 @@
+-- Time a row was last written by a scraper, used to partition and incrementally export the tables (see tripscrape/export.py)
+-- Existing rows get the time of the migration.
+
+ALTER TABLE public.attractions
+    ADD COLUMN IF NOT EXISTS scraped_at timestamp with time zone DEFAULT now();
+
+ALTER TABLE public.reviews
+    ADD COLUMN IF NOT EXISTS scraped_at timestamp with time zone DEFAULT now();
+
+ALTER TABLE public.users
+    ADD COLUMN IF NOT EXISTS scraped_at timestamp with time zone DEFAULT now();
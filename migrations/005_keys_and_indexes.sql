@@ -0,0 +1,44 @@
+-- Keys and indexes of the scrapers' write and read paths, and a typed publication date of reviews
+-- (indexes are built without CONCURRENTLY, since migrations run in a transaction; run on a quiet database)
+
+-- users.profile becomes the primary key, so that ON CONFLICT DO NOTHING in update_user deduplicates users;
+-- existing duplicates are removed first
+DELETE FROM public.users a USING public.users b
+    WHERE a.profile = b.profile AND a.ctid < b.ctid;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'users_pkey') THEN
+        ALTER TABLE ONLY public.users ADD CONSTRAINT users_pkey PRIMARY KEY (profile);
+    END IF;
+END $$;
+
+-- reviews by attraction (has_reviews, exports joined with attractions) and by user
+CREATE INDEX IF NOT EXISTS reviews_attr_id_idx ON public.reviews (attr_id);
+CREATE INDEX IF NOT EXISTS reviews_user_profile_idx ON public.reviews (user_profile);
+CREATE INDEX IF NOT EXISTS reviews_scraped_at_idx ON public.reviews (scraped_at);
+
+-- attractions left to scrape, newest id first (ReviewScraper.read_attractions and WorkQueue.claim)
+CREATE INDEX IF NOT EXISTS attractions_unscraped_idx ON public.attractions (id DESC)
+    WHERE scraped = false;
+CREATE INDEX IF NOT EXISTS attractions_unscraped_attr_type_idx ON public.attractions (attr_type, id DESC)
+    WHERE scraped = false;
+
+-- scraped attractions, least recently refreshed first (ReviewScraper.read_scraped_attractions)
+CREATE INDEX IF NOT EXISTS attractions_refresh_idx ON public.attractions (last_refreshed NULLS FIRST)
+    WHERE scraped = true;
+
+CREATE INDEX IF NOT EXISTS attractions_geom_idx ON public.attractions USING GIST (geom);
+
+-- the publication date of a review, parsed from the date string: ISO dates of the __WEB_CONTEXT__
+-- and "Month YYYY" dates of older scrapes (other formats are left NULL)
+ALTER TABLE public.reviews
+    ADD COLUMN IF NOT EXISTS published_date date;
+
+UPDATE public.reviews SET published_date = CASE
+        WHEN date ~ '^\d{4}-\d{2}-\d{2}' THEN left(date, 10)::date
+        WHEN date ~ '^[A-Za-z]+ \d{4}$' THEN to_date(date, 'FMMonth YYYY')
+    END
+    WHERE published_date IS NULL;
+
+CREATE INDEX IF NOT EXISTS reviews_published_date_idx ON public.reviews (published_date);
@@ -0,0 +1,39 @@
+-- Per-attraction summaries of the reviews, rebuilt by tripscrape/summarize.py so that dashboards
+-- do not scan the reviews table
+
+-- rating histogram, publication range and coverage of the listed reviews (attractions.num_reviews)
+CREATE TABLE IF NOT EXISTS public.attraction_ratings (
+    attr_id integer PRIMARY KEY,
+    reviews integer NOT NULL,
+    listed_reviews integer,
+    coverage real,
+    rating_1 integer NOT NULL DEFAULT 0,
+    rating_2 integer NOT NULL DEFAULT 0,
+    rating_3 integer NOT NULL DEFAULT 0,
+    rating_4 integer NOT NULL DEFAULT 0,
+    rating_5 integer NOT NULL DEFAULT 0,
+    mean_rating real,
+    first_review date,
+    last_review date,
+    updated_at timestamp with time zone DEFAULT now()
+);
+
+-- reviews per attraction and publication month
+CREATE TABLE IF NOT EXISTS public.attraction_monthly_reviews (
+    attr_id integer NOT NULL,
+    month date NOT NULL,
+    reviews integer NOT NULL,
+    mean_rating real,
+    PRIMARY KEY (attr_id, month)
+);
+CREATE INDEX IF NOT EXISTS attraction_monthly_reviews_month_idx
+    ON public.attraction_monthly_reviews (month);
+
+-- listed reviews per attraction and language, from attractions.num_reviews
+CREATE TABLE IF NOT EXISTS public.attraction_languages (
+    attr_id integer NOT NULL,
+    language character varying NOT NULL,
+    listed_reviews integer NOT NULL,
+    share real,
+    PRIMARY KEY (attr_id, language)
+);
@@ -0,0 +1,22 @@
+-- Spatial scheduling of the work queue by geohash tile and bounding box (see tripscrape/work_queue.py)
+-- (the generated column requires PostgreSQL 12)
+
+-- the total number of reviews of the num_reviews details (counts per language, or a bare count in old rows)
+CREATE OR REPLACE FUNCTION public.total_reviews(num_reviews json) RETURNS integer
+    LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE json_typeof(num_reviews)
+        WHEN 'object' THEN (SELECT sum(value::integer)::integer FROM json_each_text(num_reviews))
+        WHEN 'number' THEN (num_reviews::text)::integer
+    END
+$$;
+
+-- tiles are geohash prefixes, e.g. 5 characters for cells of about 5 x 5 km
+ALTER TABLE public.attractions
+    ADD COLUMN IF NOT EXISTS geohash character varying
+    GENERATED ALWAYS AS (public.ST_GeoHash(geom, 9)) STORED;
+
+-- claims within a tile (geohash LIKE 'gcpvj%') and what is left in a bounding box (geom && envelope)
+CREATE INDEX IF NOT EXISTS attractions_unscraped_geohash_idx
+    ON public.attractions (geohash text_pattern_ops) WHERE scraped = false;
+CREATE INDEX IF NOT EXISTS attractions_unscraped_geom_idx
+    ON public.attractions USING gist (geom) WHERE scraped = false;
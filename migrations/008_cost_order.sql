@@ -0,0 +1,6 @@
+-- Largest-first ordering of the attractions left to scrape by their remaining reviews
+-- (the expression is work_queue.REMAINING_REVIEWS and has to match it to be used)
+
+CREATE INDEX IF NOT EXISTS attractions_unscraped_cost_idx
+    ON public.attractions ((public.total_reviews(num_reviews) - coalesce(last_offset + 5, 0)) DESC NULLS LAST, id DESC)
+    WHERE scraped = false;
@@ -0,0 +1,18 @@
+-- Review page ranges of attractions that workers claim independently (see WorkQueue.claim_chunk)
+-- Pages first_page to end_page - 1 belong to a chunk, next_page is the first page not yet committed.
+
+CREATE TABLE IF NOT EXISTS public.attraction_chunks (
+    attr_id integer NOT NULL REFERENCES public.attractions (id) ON DELETE CASCADE,
+    first_page integer NOT NULL,
+    end_page integer NOT NULL,
+    next_page integer NOT NULL,
+    done boolean NOT NULL DEFAULT false,
+    lease_owner character varying,
+    lease_expires timestamp with time zone,
+    created_at timestamp with time zone DEFAULT now(),
+    PRIMARY KEY (attr_id, first_page)
+);
+
+-- open chunks, those of the earliest split attractions first
+CREATE INDEX IF NOT EXISTS attraction_chunks_open_idx
+    ON public.attraction_chunks (created_at, first_page) WHERE done = false;
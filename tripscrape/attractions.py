@@ -1,13 +1,35 @@
+import argparse
 import logging
-from time import sleep
 import re
-from random import random
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import dotenv_values
-from requests import get
-from bs4 import BeautifulSoup as bs
+from bs4 import SoupStrainer
 import psycopg2 as db
 from tripscrape import Scraper, Attraction
+from cache import CacheMiss, add_cache_arguments, cache_from_args
+from ratelimit import RetriesExhausted
+from metrics import METRICS, add_metrics_arguments, start_from_args
+
+try:
+    from lxml import html
+except ImportError:
+    html = None
+
+# only the listing cards and the pagination are built into a tree
+LISTING_CARDS = SoupStrainer("div", {"class": "_25PvF8uO _2X44Y8hm"})
+PAGINATION = SoupStrainer("div", {"class": "pageNumbers"})
+
+
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+# the same elements as the BeautifulSoup lookups in parse_listing()
+CARD_XPATH = '//div[@class="_25PvF8uO _2X44Y8hm"]'
+URL_XPATH = "(.//div[{}])[1]/descendant::a[1]/@href".format(_has_class("_2pZeTjmb"))
+NAME_XPATH = "(.//a[{}])[1]".format(_has_class("_1QKQOve4"))
+TYPE_XPATH = "(.//span[{}])[1]".format(_has_class("_21qUqkJx"))
 
 
 class AttractionScraper(Scraper):
@@ -19,12 +41,26 @@ class AttractionScraper(Scraper):
 
     db_conn : psycopg2.connection()
         a psycopg2 connection to PostgreSQL
-    place_id : int
-        a TripAdvisor place ID
+    place_id : int or list
+        a TripAdvisor place ID, or a list of place IDs whose attractions are scraped in one run
     base_url : string
         The base url to be formatted
     search_type : str
         the search type of the scraper (defaults to "reviews")
+    workers : int
+        the number of listing pages fetched and parsed concurrently (paced by the shared rate control)
+    pool_size : int
+        the number of connections kept alive per host
+    timeout : tuple
+        the (connect, read) timeout of every request in seconds
+    batch_size : int
+        the number of buffered writes that triggers a database flush
+    flush_interval : float
+        the number of seconds after which buffered writes are flushed
+    rate_control : ratelimit.RateControl
+        the rate limiter, backoff and circuit breaker of all requests (may be shared between scrapers)
+    cache : cache.ResponseCache
+        an optional on-disk cache of the responses
     """
 
     def __init__(
@@ -33,31 +69,132 @@ class AttractionScraper(Scraper):
         place_id=186338,
         base_url="https://www.tripadvisor.com/Attractions-g{}-Activities-{}-a_allAttractions.true",
         search_type="attractions",
+        pool_size=10,
+        timeout=(10, 30),
+        batch_size=500,
+        flush_interval=5.0,
+        rate_control=None,
+        cache=None,
+        workers=4,
     ):
-        super().__init__(db_conn, place_id, base_url)
+        place_ids = (
+            list(place_id) if isinstance(place_id, (list, tuple)) else [place_id]
+        )
+        super().__init__(
+            db_conn,
+            place_ids[0],
+            base_url,
+            pool_size,
+            timeout,
+            batch_size,
+            flush_interval,
+            rate_control,
+            cache,
+        )
         self.search_type = search_type
+        self.place_ids = place_ids
+        self.workers = workers
+        self.seen = set()
 
     def get_num_pages(self, soup):
         return super().get_num_pages(soup, search_type=self.search_type)
 
-    def generate_page_links(self, amount, url=None):
+    def generate_page_links(self, amount, url=None, place_id=None):
         return super().generate_page_links(
-            amount=amount, search_type=self.search_type, url=url
+            amount=amount, search_type=self.search_type, url=url, place_id=place_id
         )
 
-    def scrape_page(self, url):
-        divs = bs(get(url).content, "html.parser").find_all(
-            "div", {"class": "_25PvF8uO _2X44Y8hm"}
-        )
+    def parse_listing(self, markup):
+        """
+        Parses the listing cards of an attraction search results page.
+        With the lxml backend, the cards are selected with XPath on lxml's own tree;
+        otherwise only the cards are built into a BeautifulSoup tree.
 
-        for div in divs:
-            attraction = Attraction()
-            attraction.url = (
-                div.find("div", {"class": "_2pZeTjmb"}).find("a").get("href")
+        Parameters
+        ----------
+        markup : bytes
+            the search results page
+
+        Returns
+        -------
+        list
+            a list of (url, name, attr_type) tuples
+        """
+        if self.html_parser == "lxml" and html is not None:
+            return [
+                (
+                    card.xpath(URL_XPATH)[0],
+                    card.xpath(NAME_XPATH)[0].text_content(),
+                    card.xpath(TYPE_XPATH)[0].text_content(),
+                )
+                for card in html.fromstring(markup).xpath(CARD_XPATH)
+            ]
+
+        return [
+            (
+                div.find("div", {"class": "_2pZeTjmb"}).find("a").get("href"),
+                div.find("a", {"class": "_1QKQOve4"}).get_text(),
+                div.find("span", {"class": "_21qUqkJx"}).get_text(),
+            )
+            for div in self.make_soup(markup, LISTING_CARDS).find_all(
+                "div", {"class": "_25PvF8uO _2X44Y8hm"}
             )
-            attraction.name = div.find("a", {"class": "_1QKQOve4"}).get_text()
-            attraction.attr_type = div.find("span", {"class": "_21qUqkJx"}).get_text()
+        ]
+
+    def read_page(self, url):
+        """
+        Fetches and parses an attraction search results page (safe to call from several threads).
+
+        Parameters
+        ----------
+        url : str
+            the url of the search results page
+
+        Returns
+        -------
+        list
+            the (url, name, attr_type) tuples returned by parse_listing() (empty if the page is
+            unchanged since it was last fetched, as its attractions are already stored)
+        """
+        response = self.fetch(url)
+        if getattr(response, "unchanged", False):
+            return []
+        try:
+            with METRICS.time("parse_listing_seconds"):
+                listing = self.parse_listing(response.content)
+        except Exception:
+            self.discard(url)
+            raise
+        METRICS.count("pages")
+        return listing
+
+    def store_listing(self, listing, url):
+        """
+        Stores the attractions of a search results page, skipping those already stored in this run
+        (nearby places list some of the same attractions).
+
+        Parameters
+        ----------
+        listing : list
+            the (url, name, attr_type) tuples returned by parse_listing()
+        url : str
+            the url of the search results page
+        """
+        for attr_url, name, attr_type in listing:
+            attraction = Attraction()
+            attraction.url = attr_url
+            if attraction.ID in self.seen:
+                METRICS.count("duplicate_attractions")
+                continue
+            self.seen.add(attraction.ID)
+            attraction.name = name
+            attraction.attr_type = attr_type
+            METRICS.count("attractions")
             self.update_attraction(attraction)
+        self.mark_stored(url)
+
+    def scrape_page(self, url):
+        self.store_listing(self.read_page(url), url)
 
     def update_attraction(self, attr):
         """
@@ -69,28 +206,105 @@ class AttractionScraper(Scraper):
             an Attraction instance
         """
 
-        query_template = "INSERT INTO attractions (id, name, url, attr_type) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING;"
-        querystring = self.db_cur.mogrify(
-            query_template, (attr.ID, attr.name, attr.url, attr.attr_type)
-        )
-        return super().update_record(querystring)
+        statement = "INSERT INTO attractions (id, name, url, attr_type) VALUES %s ON CONFLICT DO NOTHING;"
+        return super().insert_row(statement, attr.as_row())
 
-    def do_scrape(self):
-        entry_page = self.base_url.format(self.place_id, "")
-        entry_soup = bs(get(entry_page).content, "html.parser")
-        number_of_pages = self.get_num_pages(entry_soup)
-        links = self.generate_page_links(number_of_pages)
+    def get_place_links(self, place_id):
+        """
+        Reads the number of search results pages of a place from its first page and generates their links.
 
-        for link in links:
-            self.scrape_page(link)
-            sleep(1.3 + random())
+        Parameters
+        ----------
+        place_id : int
+            a TripAdvisor place ID
+
+        Returns
+        -------
+        list
+            the links to all search results pages of the place (empty if its first page cannot be
+            retrieved or parsed)
+        """
+        entry_page = self.base_url.format(place_id, "")
+        try:
+            response = self.fetch(entry_page)
+        except (RetriesExhausted, CacheMiss) as e:
+            print(f"Skipping place {place_id}, giving up on {e!r}")
+            return []
+        try:
+            number_of_pages = self.get_num_pages(
+                self.make_soup(response.content, PAGINATION)
+            )
+            # a page without page numbers is a single results page, unless it has no results either
+            if number_of_pages == 1 and not self.parse_listing(response.content):
+                raise ValueError("no attractions found")
+        except Exception as e:
+            self.discard(entry_page)
+            print(f"Skipping place {place_id}, cannot read its first page: {e!r}")
+            return []
+        print(f"{place_id}: {number_of_pages} pages")
+        return self.generate_page_links(number_of_pages, place_id=place_id)
+
+    def do_scrape(self):
+        """
+        Scrapes the search results pages of all places, with up to `workers` pages fetched and parsed at once.
+        The attractions are stored by the current thread as the pages complete; pages that cannot be
+        retrieved or parsed are skipped, and the stored attractions are flushed even if the run fails.
+        """
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                links = [
+                    link
+                    for place_links in executor.map(
+                        self.get_place_links, self.place_ids
+                    )
+                    for link in place_links
+                ]
+                futures = {
+                    executor.submit(self.read_page, link): link for link in links
+                }
+                for future in as_completed(futures):
+                    try:
+                        listing = future.result()
+                    except Exception as e:
+                        print(f"Skipping page {futures[future]}, giving up on {e!r}")
+                        continue
+                    self.store_listing(listing, futures[future])
+        finally:
+            self.flush()
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Scrape TripAdvisor attractions")
+    parser.add_argument(
+        "--place-id",
+        type=int,
+        nargs="+",
+        default=[186338],
+        help="the TripAdvisor place IDs (geo IDs) whose attractions are scraped (defaults to London)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="the number of search results pages fetched concurrently",
+    )
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+    start_from_args(args)
+
     conn = db.connect(**dotenv_values())
-    a = AttractionScraper(db_conn=conn)
+    a = AttractionScraper(
+        db_conn=conn,
+        place_id=args.place_id,
+        cache=cache_from_args(args),
+        workers=args.workers,
+    )
     a.do_scrape()
+    a.close()
     a.db_conn.close()
+    if args.metrics_file is not None:
+        METRICS.write(args.metrics_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,435 @@
+import json
+import os
+import sqlite3
+import zlib
+from hashlib import sha256
+from threading import Lock
+from time import time
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from ratelimit import RetriesExhausted
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CacheMiss(RetriesExhausted):
+    """
+    Raised in cache-only mode for urls that are not cached, so that scrapers skip the
+    attraction like one whose pages cannot be retrieved.
+    """
+
+
+class ResponseCache:
+    """
+    An on-disk cache of compressed HTTP responses.
+
+    Response bodies are stored as zstd (or, without the zstandard package, zlib) compressed
+    blobs named after the SHA-256 of their url, and indexed in a SQLite database with their
+    status, headers, validators (ETag, Last-Modified and the SHA-256 of the body), size and
+    fetch and access times. Entries older than `ttl` are not served but revalidated with a
+    conditional request, and the least recently used entries are evicted once the blobs
+    exceed `max_size`. The hash of the last body whose rows were committed to the database
+    (see mark_stored()) tells unchanged pages apart from pages that still have to be stored.
+
+    Attributes
+    ----------
+    directory : str
+        the directory holding the index and the blobs
+    ttl : float
+        the number of seconds a response is served from the cache (forever if None)
+    max_size : int
+        the maximum total size of the compressed blobs in bytes (unbounded if None)
+    cache_only : bool
+        whether to serve all cached responses regardless of their age and never go to the network
+    level : int
+        the compression level
+    """
+
+    def __init__(self, directory, ttl=None, max_size=None, cache_only=False, level=3):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache_only = cache_only
+        self.level = level
+        self.codec = "zstd" if zstandard is not None else "zlib"
+        os.makedirs(directory, exist_ok=True)
+        self._lock = Lock()
+        self._db = sqlite3.connect(
+            os.path.join(directory, "index.sqlite"), check_same_thread=False
+        )
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                encoding TEXT,
+                headers TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                stored_hash TEXT
+            )"""
+        )
+        # indexes created before the validators and stored hashes were kept
+        columns = {
+            row[1] for row in self._db.execute("PRAGMA table_info(responses)")
+        }
+        for column in ("etag", "last_modified", "content_hash", "stored_hash"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE responses ADD COLUMN {column} TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def _compress(self, data):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return zlib.compress(data, self.level)
+
+    def _decompress(self, data, codec):
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read zstd entries")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def get(self, url, stale=False):
+        """
+        Returns the cached response of a url.
+
+        Parameters
+        ----------
+        url : str
+            the url of the response
+        stale : bool
+            whether to return expired entries as well (e.g. after a 304 response)
+
+        Returns
+        -------
+        requests.Response
+            the cached response with a from_cache attribute set to True, or None if the url is
+            not cached (or its entry has expired and neither stale nor the cache-only mode is set)
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, codec, status, encoding, headers, fetched_at "
+                "FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            key, codec, status, encoding, headers, fetched_at = row
+            expired = self.ttl is not None and time() - fetched_at > self.ttl
+            if expired and not self.cache_only and not stale:
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                self._delete(url, key)
+                return None
+            self._db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE url = ?", (time(), url)
+            )
+            self._db.commit()
+
+        response = Response()
+        response.url = url
+        response.status_code = status
+        response.encoding = encoding
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = self._decompress(data, codec)
+        response.from_cache = True
+        response.unchanged = False
+        return response
+
+    def put(self, url, response):
+        """
+        Stores a response, evicting the least recently used entries if the cache is full.
+        The body is only written if it differs from the cached one, and the entry keeps the
+        hash of the last body marked as stored.
+
+        Parameters
+        ----------
+        url : str
+            the requested url (which may differ from response.url after redirects)
+        response : requests.Response
+            the response to be stored
+
+        Returns
+        -------
+        bool
+            True if the body is identical to the last one marked as stored
+        """
+        key = sha256(url.encode()).hexdigest()
+        content_hash = sha256(response.content).hexdigest()
+        with self._lock:
+            previous = self._db.execute(
+                "SELECT size, content_hash, stored_hash FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+        stored_hash = None if previous is None else previous[2]
+        cached = (
+            previous is not None
+            and previous[1] == content_hash
+            and os.path.exists(self._path(key))
+        )
+
+        if cached:
+            size = previous[0]
+        else:
+            data = self._compress(response.content)
+            size = len(data)
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+
+        with self._lock:
+            if previous is not None:
+                self._size -= previous[0]
+            now = time()
+            self._db.execute(
+                """INSERT OR REPLACE INTO responses (url, key, codec, status, encoding, headers, size,
+                    fetched_at, accessed_at, etag, last_modified, content_hash, stored_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    url,
+                    key,
+                    self.codec,
+                    response.status_code,
+                    response.encoding,
+                    json.dumps(dict(response.headers)),
+                    size,
+                    now,
+                    now,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    content_hash,
+                    stored_hash,
+                ),
+            )
+            self._size += size
+            self._db.commit()
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict(self.max_size)
+        return stored_hash == content_hash
+
+    def validators(self, url):
+        """
+        Returns the headers of a conditional request for a cached url.
+
+        Parameters
+        ----------
+        url : str
+            the url to be requested
+
+        Returns
+        -------
+        dict
+            If-None-Match and If-Modified-Since headers from the cached ETag and Last-Modified
+            (empty if the url is not cached or its response had no validators)
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        headers = {}
+        if row is not None and row[0] is not None:
+            headers["If-None-Match"] = row[0]
+        if row is not None and row[1] is not None:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def touch(self, url):
+        """
+        Marks the cached response of a url as fetched now, after the server confirmed it with a 304.
+
+        Parameters
+        ----------
+        url : str
+            the url of the response
+        """
+        with self._lock:
+            now = time()
+            self._db.execute(
+                "UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                (now, now, url),
+            )
+            self._db.commit()
+
+    def stored(self, url):
+        """
+        Returns whether the cached body of a url is the last one marked as stored.
+
+        Parameters
+        ----------
+        url : str
+            the url of the response
+
+        Returns
+        -------
+        bool
+            False if the url is not cached or its cached body was never marked as stored
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_hash = stored_hash FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        return row is not None and bool(row[0])
+
+    def mark_stored(self, url):
+        """
+        Marks the cached body of a url as stored, once the rows read from it are committed.
+
+        Parameters
+        ----------
+        url : str
+            the url of the response
+        """
+        with self._lock:
+            self._db.execute(
+                "UPDATE responses SET stored_hash = content_hash WHERE url = ?", (url,)
+            )
+            self._db.commit()
+
+    def delete(self, url):
+        """
+        Removes the cached response of a url, if any.
+
+        Parameters
+        ----------
+        url : str
+            the url of the response
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is not None:
+                self._delete(url, row[0])
+                self._db.commit()
+
+    def evict(self):
+        """
+        Removes all expired entries, and the least recently used ones if the cache is full.
+        Expired entries are otherwise kept, so that they can be revalidated with a conditional
+        request; evicting them trades that for disk space (see --cache-evict).
+        """
+        with self._lock:
+            if self.ttl is not None:
+                expired = self._db.execute(
+                    "SELECT url, key FROM responses WHERE fetched_at < ?",
+                    (time() - self.ttl,),
+                ).fetchall()
+                for url, key in expired:
+                    self._delete(url, key)
+                self._db.commit()
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict(self.max_size)
+
+    def _evict(self, max_size):
+        # evict down to 90% of the maximum size, so that eviction does not run on every put
+        rows = self._db.execute(
+            "SELECT url, key FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        for url, key in rows:
+            if self._size <= 0.9 * max_size:
+                break
+            self._delete(url, key)
+        self._db.commit()
+
+    def _delete(self, url, key):
+        size = self._db.execute(
+            "SELECT size FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if size is not None:
+            self._size -= size[0]
+        self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """
+        Closes the index.
+        """
+        with self._lock:
+            self._db.close()
+
+
+def add_cache_arguments(parser):
+    """
+    Adds the command line arguments of the response cache to an ArgumentParser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        the parser of a scraper script
+    """
+    parser.add_argument("--cache", help="the directory of the response cache")
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="the number of seconds a cached response is served",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        help="the maximum size of the compressed responses in bytes",
+    )
+    parser.add_argument(
+        "--cache-only",
+        action="store_true",
+        help="parse cached responses only and never go to the network",
+    )
+    parser.add_argument(
+        "--cache-evict",
+        action="store_true",
+        help="remove the responses older than --cache-ttl from the cache on start instead of revalidating them",
+    )
+
+
+def cache_from_args(args):
+    """
+    Creates the response cache configured by the command line arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments parsed with add_cache_arguments()
+
+    Returns
+    -------
+    ResponseCache
+        the response cache, or None if no cache directory was passed
+    """
+    if args.cache is None:
+        return None
+    cache = ResponseCache(
+        args.cache,
+        ttl=args.cache_ttl,
+        max_size=args.cache_max_size,
+        cache_only=args.cache_only,
+    )
+    if args.cache_evict:
+        cache.evict()
+    return cache
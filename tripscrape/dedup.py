@@ -0,0 +1,237 @@
+from hashlib import blake2b
+from math import exp, log
+
+from metrics import METRICS
+
+
+class SeenSet:
+    """
+    An exact set of the keys (user profiles or review ids) already passed to the database.
+
+    Attributes
+    ----------
+    name : str
+        the name of the set in the metrics, e.g. "users"
+    lookups : int
+        the number of keys checked with seen()
+    hits : int
+        the number of keys that had been seen before
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lookups = 0
+        self.hits = 0
+        self._keys = set()
+
+    def _add(self, key):
+        # returns whether the key was already present
+        if key in self._keys:
+            return True
+        self._keys.add(key)
+        return False
+
+    def seen(self, key):
+        """
+        Checks whether a key was seen before and adds it otherwise.
+
+        Parameters
+        ----------
+        key : str or int
+            a user profile or review id
+
+        Returns
+        -------
+        bool
+            True if the key was seen before, so that its row can be skipped
+        """
+        hit = self._add(key)
+        self.lookups += 1
+        METRICS.count("dedup_lookups", self.name)
+        if hit:
+            self.hits += 1
+            METRICS.count("dedup_hits", self.name)
+        return hit
+
+    def update(self, keys):
+        """
+        Adds keys without counting them as lookups (used for preloading).
+
+        Parameters
+        ----------
+        keys : iterable
+            user profiles or review ids
+        """
+        for key in keys:
+            self._add(key)
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def report(self):
+        return "{}: {} of {} skipped ({:.1%})".format(
+            self.name, self.hits, self.lookups, self.hit_rate
+        )
+
+
+class BloomFilter(SeenSet):
+    """
+    A bloom filter of the keys already passed to the database, with a fixed memory budget.
+
+    A false positive drops a new row, which happens with a probability of about
+    false_positive_rate; use a SeenSet where no row may be lost.
+
+    Attributes
+    ----------
+    name : str
+        the name of the filter in the metrics, e.g. "users"
+    size : int
+        the memory budget of the bit array in bytes
+    capacity : int
+        the expected number of keys, which determines the number of hash functions
+    """
+
+    def __init__(self, name, size, capacity):
+        super().__init__(name)
+        self.size = size
+        self.capacity = capacity
+        self._bits = bytearray(size)
+        self._m = size * 8
+        self._k = max(1, round(self._m / max(capacity, 1) * log(2)))
+        self._n = 0
+
+    def _add(self, key):
+        digest = blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        present = True
+        for i in range(self._k):
+            bit = (h1 + i * h2) % self._m
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self._bits[byte] & mask:
+                present = False
+                self._bits[byte] |= mask
+        if not present:
+            self._n += 1
+        return present
+
+    @property
+    def false_positive_rate(self):
+        """
+        The estimated probability that a new key is reported as seen.
+        """
+        return (1 - exp(-self._k * self._n / self._m)) ** self._k
+
+    def report(self):
+        return super().report() + ", estimated false positive rate {:.2%}".format(
+            self.false_positive_rate
+        )
+
+
+class Dedup:
+    """
+    Process-wide duplicate filters of the users and reviews passed to the database.
+
+    Attributes
+    ----------
+    users : SeenSet
+        the filter of user profiles
+    reviews : SeenSet
+        the filter of review ids
+    """
+
+    def __init__(self, users, reviews):
+        self.users = users
+        self.reviews = reviews
+
+    @classmethod
+    def preload(cls, db_conn, kind="exact", memory=64 * 2 ** 20):
+        """
+        Creates the filters and loads all stored user profiles and review ids into them.
+
+        Parameters
+        ----------
+        db_conn : psycopg2.connection()
+            a psycopg2 connection to PostgreSQL
+        kind : str
+            "exact" for sets or "bloom" for bloom filters
+        memory : int
+            the memory budget of both bloom filters together in bytes (split evenly)
+
+        Returns
+        -------
+        Dedup
+            the preloaded filters
+        """
+        filters = []
+        for name, query in (
+            ("users", "SELECT profile FROM users"),
+            ("reviews", "SELECT id FROM reviews"),
+        ):
+            with db_conn.cursor() as cur:
+                cur.execute(f"SELECT count(*) FROM ({query}) AS keys;")
+                count = cur.fetchone()[0]
+            if kind == "bloom":
+                seen = BloomFilter(name, memory // 2, max(2 * count, 100_000))
+            else:
+                seen = SeenSet(name)
+            # a named cursor streams the keys instead of loading them all at once
+            with db_conn.cursor(name=f"dedup_{name}") as cur:
+                cur.itersize = 10_000
+                cur.execute(query)
+                seen.update(row[0] for row in cur)
+            print(f"Preloaded {count} {name}")
+            filters.append(seen)
+        db_conn.commit()
+        return cls(*filters)
+
+    def report(self):
+        """
+        Prints the hit rate of both filters.
+        """
+        reports = [f.report() for f in (self.users, self.reviews)]
+        print("Duplicates: " + "; ".join(reports))
+
+
+def add_dedup_arguments(parser):
+    """
+    Adds the command line arguments of the duplicate filters to an ArgumentParser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        the parser of a scraper script
+    """
+    parser.add_argument(
+        "--dedup",
+        choices=("exact", "bloom"),
+        help="skip users and reviews that were already stored or seen in this run",
+    )
+    parser.add_argument(
+        "--dedup-memory",
+        type=int,
+        default=64,
+        help="the memory budget of the bloom filters in MB",
+    )
+
+
+def dedup_from_args(args, db_conn):
+    """
+    Creates the duplicate filters configured by the command line arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments parsed with add_dedup_arguments()
+    db_conn : psycopg2.connection()
+        a psycopg2 connection to PostgreSQL
+
+    Returns
+    -------
+    Dedup
+        the preloaded filters, or None if no --dedup was passed
+    """
+    if args.dedup is None:
+        return None
+    return Dedup.preload(db_conn, kind=args.dedup, memory=args.dedup_memory * 2 ** 20)
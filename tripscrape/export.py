@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import psycopg2 as db
+from dotenv import dotenv_values
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+WATERMARK_FILE = "_watermark.json"
+
+# every query selects the partition values first, followed by the exported columns;
+# rows are ordered by partition, so that only one partition is buffered at a time
+TABLES = {
+    "attractions": (
+        """SELECT a.attr_type, (a.scraped_at AT TIME ZONE 'UTC')::date,
+            a.id, a.name, a.url, ST_Y(a.geom), ST_X(a.geom), a.num_reviews::text, a.scraped, a.scraped_at
+        FROM attractions a""",
+        "a.scraped_at",
+        ("attr_type", "scraped_date"),
+        [
+            ("id", "int64"),
+            ("name", "string"),
+            ("url", "string"),
+            ("latitude", "float64"),
+            ("longitude", "float64"),
+            ("num_reviews", "string"),
+            ("scraped", "bool"),
+            ("scraped_at", "timestamp"),
+        ],
+    ),
+    "reviews": (
+        """SELECT a.attr_type, (r.scraped_at AT TIME ZONE 'UTC')::date,
+            r.id, r.title, r.rating, r.date, r."full", r.user_profile, r.attr_id,
+            r.published_date, r.scraped_at
+        FROM reviews r LEFT JOIN attractions a ON a.id = r.attr_id""",
+        "r.scraped_at",
+        ("attr_type", "scraped_date"),
+        [
+            ("id", "int64"),
+            ("title", "string"),
+            ("rating", "int32"),
+            ("date", "string"),
+            ("full", "string"),
+            ("user_profile", "string"),
+            ("attr_id", "int64"),
+            ("published_date", "date32"),
+            ("scraped_at", "timestamp"),
+        ],
+    ),
+    "users": (
+        """SELECT (u.scraped_at AT TIME ZONE 'UTC')::date,
+            u.profile, u.location, u.contributions, u.helpful_votes, u.scraped_at
+        FROM users u""",
+        "u.scraped_at",
+        ("scraped_date",),
+        [
+            ("profile", "string"),
+            ("location", "string"),
+            ("contributions", "int32"),
+            ("helpful_votes", "int32"),
+            ("scraped_at", "timestamp"),
+        ],
+    ),
+}
+
+
+def arrow_schema(columns):
+    types = {
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "string": pa.string(),
+        "date32": pa.date32(),
+        "timestamp": pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[t]) for name, t in columns])
+
+
+class Exporter:
+    """
+    Streams the scraped tables into files partitioned by attraction type and scrape date.
+
+    Rows are read with a server-side (named) cursor and written row group by row group,
+    so memory use is bounded by the row group size regardless of the table size. Files are
+    laid out as <directory>/<table>/attr_type=<type>/scraped_date=<date>/part-<run>.<format>,
+    which pyarrow.dataset reads as a hive-partitioned dataset.
+
+    With incremental exports, only rows written since the watermark of the previous export
+    are exported. Rows written less than `lag` seconds before the export are left for the
+    next one, since transactions still in flight may commit rows with earlier times.
+    Full exports should be written to an empty directory.
+
+    Attributes
+    ----------
+    db_conn : psycopg2.connection()
+        a psycopg2 connection to PostgreSQL (switched to read-only)
+    directory : str
+        the output directory
+    format : str
+        "parquet" or "arrow" (Arrow IPC files)
+    row_group_size : int
+        the number of rows per row group (and per database round trip)
+    compression : str
+        the Parquet compression codec
+    lag : float
+        the number of seconds recent rows are held back
+    """
+
+    def __init__(
+        self,
+        db_conn,
+        directory,
+        format="parquet",
+        row_group_size=100_000,
+        compression="zstd",
+        lag=300,
+    ):
+        if pa is None:
+            raise RuntimeError("pyarrow is required to export tables")
+        self.db_conn = db_conn
+        self.db_conn.set_session(readonly=True)
+        self.directory = directory
+        self.format = format
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.lag = lag
+        self.run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+    def read_watermarks(self):
+        path = os.path.join(self.directory, WATERMARK_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def write_watermarks(self, watermarks):
+        path = os.path.join(self.directory, WATERMARK_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(watermarks, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def partition_path(self, table, names, values):
+        parts = [
+            "{}={}".format(
+                name,
+                "__HIVE_DEFAULT_PARTITION__"
+                if value is None
+                else quote(str(value), safe=" &"),
+            )
+            for name, value in zip(names, values)
+        ]
+        return os.path.join(
+            self.directory, table, *parts, f"part-{self.run}.{self.format}"
+        )
+
+    def open_writer(self, path, schema):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.format == "arrow":
+            return pa.ipc.new_file(path, schema)
+        return pq.ParquetWriter(path, schema, compression=self.compression)
+
+    def write_row_group(self, writer, schema, rows):
+        columns = list(zip(*rows))
+        batch = pa.record_batch(
+            [pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema
+        )
+        if self.format == "arrow":
+            writer.write_batch(batch)
+        else:
+            writer.write_table(pa.Table.from_batches([batch]))
+
+    def export_table(self, table, since=None, until=None):
+        """
+        Exports a table.
+
+        Parameters
+        ----------
+        table : str
+            "attractions", "reviews" or "users"
+        since : str
+            an ISO timestamp; only rows written after it are exported (all rows if None)
+        until : str
+            an ISO timestamp; only rows written up to it are exported (no limit if None)
+
+        Returns
+        -------
+        int
+            the number of exported rows
+        """
+        query, time_column, partitions, columns = TABLES[table]
+        schema = arrow_schema(columns)
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append(f"{time_column} > %s")
+            params.append(since)
+        if until is not None:
+            conditions.append(f"{time_column} <= %s")
+            params.append(until)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY " + ", ".join(str(i + 1) for i in range(len(partitions)))
+
+        n = len(partitions)
+        count = 0
+        writer = None
+        key = None
+        buffer = []
+        with self.db_conn.cursor(name=f"export_{table}") as cur:
+            cur.itersize = self.row_group_size
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(self.row_group_size)
+                for row in rows:
+                    if row[:n] != key:
+                        if buffer:
+                            self.write_row_group(writer, schema, buffer)
+                            buffer = []
+                        if writer is not None:
+                            writer.close()
+                        key = row[:n]
+                        writer = self.open_writer(
+                            self.partition_path(table, partitions, key), schema
+                        )
+                    buffer.append(row[n:])
+                    if len(buffer) >= self.row_group_size:
+                        self.write_row_group(writer, schema, buffer)
+                        buffer = []
+                    count += 1
+                if not rows:
+                    break
+        if buffer:
+            self.write_row_group(writer, schema, buffer)
+        if writer is not None:
+            writer.close()
+        self.db_conn.commit()
+        return count
+
+    def export(self, tables=tuple(TABLES), incremental=False):
+        """
+        Exports tables and records the watermark of the export.
+
+        Parameters
+        ----------
+        tables : iterable
+            the names of the tables to be exported
+        incremental : bool
+            whether to export only the rows written since the previous export
+        """
+        watermarks = self.read_watermarks()
+        with self.db_conn.cursor() as cur:
+            cur.execute("SELECT now() - %s * interval '1 second';", (self.lag,))
+            until = cur.fetchone()[0].isoformat()
+        self.db_conn.commit()
+
+        for table in tables:
+            since = watermarks.get(table) if incremental else None
+            count = self.export_table(table, since=since, until=until)
+            print(f"Exported {count} {table}" + (f" since {since}" if since else ""))
+            watermarks[table] = until
+        self.write_watermarks(watermarks)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the scraped tables to partitioned Parquet or Arrow files"
+    )
+    parser.add_argument("directory", help="the output directory")
+    parser.add_argument(
+        "--table",
+        action="append",
+        choices=list(TABLES),
+        help="a table to be exported (defaults to all tables)",
+    )
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    parser.add_argument("--row-group-size", type=int, default=100_000)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="export only the rows written since the previous export to the directory",
+    )
+    args = parser.parse_args()
+
+    conn = db.connect(**dotenv_values())
+    exporter = Exporter(
+        conn, args.directory, format=args.format, row_group_size=args.row_group_size
+    )
+    exporter.export(tables=args.table or list(TABLES), incremental=args.incremental)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
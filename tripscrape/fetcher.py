@@ -0,0 +1,43 @@
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from requests import get
+
+
+class AsyncFetcher:
+    """
+    Fetches web pages concurrently with a bounded number of requests in flight per host.
+    The requests are paced by the passed get function, e.g. Scraper.fetch().
+
+    Attributes
+    ----------
+    max_per_host : int
+        the maximum number of concurrent requests per host
+    get : callable
+        a blocking function taking a url and returning a requests.Response
+    """
+
+    def __init__(self, max_per_host=4, get=get):
+        self.max_per_host = max_per_host
+        self.get = get
+        self._semaphores = defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+
+    async def fetch(self, url):
+        """
+        Fetches a single url once a slot for its host is available.
+
+        Parameters
+        ----------
+        url : str
+            the url to be fetched
+
+        Returns
+        -------
+        requests.Response
+            the response of the request
+        """
+        host = urlsplit(url).netloc
+        async with self._semaphores[host]:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.get, url)
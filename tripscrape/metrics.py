@@ -0,0 +1,314 @@
+import json
+import os
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import monotonic, perf_counter, sleep, time
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """
+    A histogram of durations with fixed bucket bounds (thread-safe).
+
+    Attributes
+    ----------
+    buckets : tuple
+        the ascending upper bounds of the buckets in seconds
+    count : int
+        the number of observations
+    sum : float
+        the sum of all observations
+    max : float
+        the largest observation
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def snapshot(self):
+        """
+        Returns the count, sum, mean, maximum and cumulative bucket counts of the histogram.
+        """
+        with self._lock:
+            cumulative = []
+            total = 0
+            for bound, n in zip(self.buckets + ("+Inf",), self.counts):
+                total += n
+                cumulative.append((bound, total))
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else 0.0,
+                "max": self.max,
+                "buckets": cumulative,
+            }
+
+
+class Metrics:
+    """
+    A registry of timing histograms and counters, with throttled logging.
+
+    Counters may carry a single `type` label (e.g. the type of a missing field); rates per
+    second are computed over the lifetime of the registry. The registry can be served in the
+    Prometheus text format with serve() or dumped as JSON periodically with dump().
+
+    Attributes
+    ----------
+    prefix : str
+        the prefix of all exported metric names
+    start : float
+        the time the registry was created at
+    """
+
+    def __init__(self, prefix="tripscrape"):
+        self.prefix = prefix
+        self.start = time()
+        self._histograms = {}
+        self._counters = {}
+        self._logged = {}
+        self._lock = Lock()
+
+    def observe(self, name, seconds):
+        """
+        Records a duration in the histogram of the passed name.
+
+        Parameters
+        ----------
+        name : str
+            the name of the histogram, e.g. "fetch_seconds"
+        seconds : float
+            the duration
+        """
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            histogram = self._histograms[name]
+        histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, name):
+        """
+        Times the enclosed block into the histogram of the passed name.
+
+        Parameters
+        ----------
+        name : str
+            the name of the histogram
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def count(self, name, type=None, n=1):
+        """
+        Increments a counter.
+
+        Parameters
+        ----------
+        name : str
+            the name of the counter, e.g. "reviews"
+        type : str
+            an optional label value, e.g. the type of a missing field
+        n : int
+            the increment
+        """
+        with self._lock:
+            self._counters[name, type] = self._counters.get((name, type), 0) + n
+
+    def log(self, key, message, interval=10.0):
+        """
+        Prints a message unless a message with the same key was printed within the interval.
+        The number of suppressed messages is appended to the next printed one.
+
+        Parameters
+        ----------
+        key : str
+            the kind of the message
+        message : str
+            the message
+        interval : float
+            the minimum number of seconds between two messages of the same key
+        """
+        now = monotonic()
+        with self._lock:
+            last, suppressed = self._logged.get(key, (None, 0))
+            if last is not None and now - last < interval:
+                self._logged[key] = (last, suppressed + 1)
+                return
+            self._logged[key] = (now, 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        print(message)
+
+    def snapshot(self):
+        """
+        Returns all counters, their rates per second and the histograms as a dict.
+        """
+        elapsed = max(time() - self.start, 1e-9)
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        return {
+            "uptime": elapsed,
+            "counters": {
+                name if type is None else f"{name}{{type={type}}}": n
+                for (name, type), n in counters.items()
+            },
+            "rates": {
+                f"{name}_per_second": n / elapsed
+                for (name, type), n in counters.items()
+                if type is None
+            },
+            "histograms": {
+                name: histogram.snapshot() for name, histogram in histograms.items()
+            },
+        }
+
+    def prometheus(self):
+        """
+        Returns all counters and histograms in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = sorted(
+                self._counters.items(), key=lambda c: (c[0][0], str(c[0][1]))
+            )
+            histograms = sorted(self._histograms.items())
+        lines = []
+        for (name, type), n in counters:
+            label = "" if type is None else '{type="%s"}' % type.replace('"', '\\"')
+            lines.append(f"{self.prefix}_{name}_total{label} {n}")
+        for name, histogram in histograms:
+            snapshot = histogram.snapshot()
+            for bound, n in snapshot["buckets"]:
+                lines.append(f'{self.prefix}_{name}_bucket{{le="{bound}"}} {n}')
+            lines.append(f"{self.prefix}_{name}_sum {snapshot['sum']}")
+            lines.append(f"{self.prefix}_{name}_count {snapshot['count']}")
+        lines.append(f"{self.prefix}_uptime_seconds {time() - self.start}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the metrics in the Prometheus text format at http://host:port/metrics in a background thread.
+
+        Parameters
+        ----------
+        port : int
+            the port to listen on
+        host : str
+            the interface to listen on (defaults to localhost only)
+
+        Returns
+        -------
+        ThreadingHTTPServer
+            the running server
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def dump(self, path, interval=60.0):
+        """
+        Writes a JSON snapshot of the metrics to a file every interval in a background thread.
+
+        Parameters
+        ----------
+        path : str
+            the path of the JSON file (replaced atomically)
+        interval : float
+            the number of seconds between two snapshots
+        """
+
+        def _dump():
+            while True:
+                sleep(interval)
+                self.write(path)
+
+        Thread(target=_dump, daemon=True).start()
+
+    def write(self, path):
+        """
+        Writes a JSON snapshot of the metrics to a file.
+
+        Parameters
+        ----------
+        path : str
+            the path of the JSON file (replaced atomically)
+        """
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+METRICS = Metrics()
+
+
+def add_metrics_arguments(parser):
+    """
+    Adds the command line arguments of the metrics export to an ArgumentParser.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        the parser of a scraper script
+    """
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics at http://127.0.0.1:<port>/metrics",
+    )
+    parser.add_argument("--metrics-file", help="dump the metrics as JSON to a file")
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=60.0,
+        help="the number of seconds between two JSON dumps",
+    )
+
+
+def start_from_args(args):
+    """
+    Starts the metrics exports configured by the command line arguments.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        the arguments parsed with add_metrics_arguments()
+    """
+    if args.metrics_port is not None:
+        METRICS.serve(args.metrics_port)
+    if args.metrics_file is not None:
+        METRICS.dump(args.metrics_file, args.metrics_interval)
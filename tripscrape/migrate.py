@@ -0,0 +1,52 @@
+import os
+
+import psycopg2 as db
+from dotenv import dotenv_values
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "migrations"
+)
+
+
+def migrate(db_conn, directory=MIGRATIONS_DIR):
+    """
+    Applies all migrations in the passed directory that have not been applied yet, in order of their file names.
+    Applied versions are recorded in the schema_migrations table.
+
+    Parameters
+    ----------
+    db_conn : psycopg2.connection()
+        a psycopg2 connection to PostgreSQL
+    directory : str
+        the directory containing the numbered .sql migration files
+    """
+    cur = db_conn.cursor()
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS public.schema_migrations (version character varying PRIMARY KEY, applied_at timestamp with time zone DEFAULT now());"
+    )
+    db_conn.commit()
+
+    cur.execute("SELECT version FROM public.schema_migrations;")
+    applied = {row[0] for row in cur.fetchall()}
+
+    for filename in sorted(os.listdir(directory)):
+        version, ext = os.path.splitext(filename)
+        if ext != ".sql" or version in applied:
+            continue
+        print(f"Applying migration {version}")
+        with open(os.path.join(directory, filename)) as f:
+            cur.execute(f.read())
+        cur.execute(
+            "INSERT INTO public.schema_migrations (version) VALUES (%s);", (version,)
+        )
+        db_conn.commit()
+
+
+def main():
+    conn = db.connect(**dotenv_values())
+    migrate(conn)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+
+from metrics import METRICS
+
+
+class Job:
+    """
+    A page to be fetched, parsed and persisted.
+
+    Attributes
+    ----------
+    url : str
+        the url of the page
+    context : object
+        a picklable value passed to the parse function along with the page (e.g. an attraction id)
+    attempt : int
+        the number of failed attempts so far
+    """
+
+    def __init__(self, url, context, attempt=0):
+        self.url = url
+        self.context = context
+        self.attempt = attempt
+
+
+class Stage:
+    """
+    Throughput counters of a pipeline stage.
+
+    Attributes
+    ----------
+    name : str
+        the name of the stage
+    queue : queue.Queue
+        the bounded input queue of the stage
+    count : int
+        the number of items processed
+    busy : float
+        the number of seconds spent processing, summed over all workers of the stage
+    """
+
+    def __init__(self, name, queue):
+        self.name = name
+        self.queue = queue
+        self.count = 0
+        self.busy = 0.0
+        self._lock = Lock()
+
+    def record(self, seconds):
+        METRICS.observe(f"pipeline_{self.name}_seconds", seconds)
+        with self._lock:
+            self.count += 1
+            self.busy += seconds
+
+    def report(self, elapsed):
+        return "{}: {} ({:.2f}/s, {:.1f}s busy), queue {}/{}".format(
+            self.name,
+            self.count,
+            self.count / elapsed if elapsed else 0,
+            self.busy,
+            self.queue.qsize(),
+            self.queue.maxsize,
+        )
+
+
+class Pipeline:
+    """
+    A staged fetch -> parse -> persist pipeline connected by bounded queues.
+
+    Pages are fetched by a pool of threads, parsed by a pool of processes (each driven by a
+    parser thread) and persisted by a single writer running in the calling thread, so that the
+    database connection is only used by one thread. Full queues block the previous stage.
+    Pages whose parse raises a ValueError are discarded and fetched again with backoff, up to
+    `max_attempts` times; pages that cannot be fetched or parsed (or whose parse raises any other
+    error) are passed to the writer as failed.
+
+    Attributes
+    ----------
+    fetch : callable
+        a function taking a url and returning a requests.Response, e.g. Scraper.fetch()
+    parse : callable
+        a picklable top-level function taking the page text and a job context, raising a ValueError if the page has to be fetched again
+    rate_control : ratelimit.RateControl
+        the rate control providing the backoff of refetched pages
+    fetch_workers : int
+        the number of fetcher threads
+    parse_workers : int
+        the number of parser processes
+    queue_size : int
+        the capacity of every queue between two stages
+    report_interval : float
+        the number of seconds between two progress reports (no reports if None)
+    discard : callable
+        an optional function taking the url of a page that could not be parsed, e.g. Scraper.discard(),
+        so that it is not fetched again from a cache
+    """
+
+    def __init__(
+        self,
+        fetch,
+        parse,
+        rate_control,
+        fetch_workers=4,
+        parse_workers=2,
+        queue_size=32,
+        report_interval=60,
+        discard=None,
+    ):
+        self.fetch = fetch
+        self.parse = parse
+        self.rate_control = rate_control
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.discard = discard
+
+        self._jobs = Queue(queue_size)
+        self._retries = Queue()
+        self._pages = Queue(queue_size)
+        self._results = Queue(queue_size)
+        self.stages = [
+            Stage("fetch", self._jobs),
+            Stage("parse", self._pages),
+            Stage("persist", self._results),
+        ]
+        self._submitted = 0
+        self._lock = Lock()
+
+    def submit(self, url, context):
+        """
+        Enqueues a page, blocking while the fetch queue is full.
+
+        Parameters
+        ----------
+        url : str
+            the url of the page
+        context : object
+            a picklable value passed to the parse function along with the page
+        """
+        with self._lock:
+            self._submitted += 1
+        self._jobs.put(Job(url, context))
+
+    def emit(self, message):
+        """
+        Passes a message to the writer, ahead of all pages submitted after it.
+
+        Parameters
+        ----------
+        message : object
+            any value, passed to the persist function as ("message", message)
+        """
+        self._results.put(("message", message))
+
+    def _next_job(self):
+        while True:
+            try:
+                return self._retries.get_nowait()
+            except Empty:
+                pass
+            try:
+                return self._jobs.get(timeout=0.1)
+            except Empty:
+                continue
+
+    def _fetcher(self):
+        stage = self.stages[0]
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            start = monotonic()
+            try:
+                response = self.fetch(job.url)
+            except Exception as e:
+                self._results.put(("failed", job, e))
+                continue
+            stage.record(monotonic() - start)
+            if getattr(response, "unchanged", False):
+                # already persisted when it was last fetched, so it skips the parsers
+                self._results.put(("unchanged", job, None))
+            else:
+                self._pages.put((job, response.text))
+
+    def _parser(self, pool):
+        stage = self.stages[1]
+        while True:
+            item = self._pages.get()
+            if item is None:
+                return
+            job, text = item
+            start = monotonic()
+            try:
+                result = pool.submit(self.parse, text, job.context).result()
+            except ValueError as e:
+                if self.discard is not None:
+                    self.discard(job.url)
+                job.attempt += 1
+                if job.attempt >= self.rate_control.max_attempts:
+                    self._results.put(("failed", job, e))
+                else:
+                    METRICS.count("page_retries", "pipeline")
+                    METRICS.log("refetching", f"Refetching {job.url}: {e}")
+                    Thread(target=self._retry, args=(job,), daemon=True).start()
+                continue
+            except Exception as e:
+                # any other error (e.g. a malformed review or a dead parser process) fails the page,
+                # so that the writer still accounts for it
+                METRICS.count("parse_errors")
+                self._results.put(("failed", job, e))
+                continue
+            stage.record(monotonic() - start)
+            self._results.put(("page", job, result))
+
+    def _retry(self, job):
+        sleep(self.rate_control.failure(urlsplit(job.url).netloc, job.attempt - 1))
+        self._retries.put(job)
+
+    def _reporter(self, start, done):
+        while not done:
+            sleep(self.report_interval)
+            if not done:
+                self.report(start)
+
+    def report(self, start):
+        """
+        Prints the throughput and queue depth of every stage.
+
+        Parameters
+        ----------
+        start : float
+            the monotonic time the pipeline was started at
+        """
+        elapsed = monotonic() - start
+        print(" | ".join(stage.report(elapsed) for stage in self.stages))
+
+    def run(self, produce, persist):
+        """
+        Runs the pipeline until all submitted pages are persisted or failed.
+
+        Parameters
+        ----------
+        produce : callable
+            a function taking the pipeline, called in a producer thread to submit pages and emit messages
+        persist : callable
+            a function called in the current thread for every ("message", message), ("page", job, result),
+            ("unchanged", job, None) and ("failed", job, exception) tuple
+        """
+        start = monotonic()
+        done = []
+        errors = []
+
+        def _produce():
+            try:
+                produce(self)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self._results.put(("produced",))
+
+        with ProcessPoolExecutor(self.parse_workers) as pool:
+            threads = [
+                Thread(target=self._fetcher, daemon=True)
+                for _ in range(self.fetch_workers)
+            ] + [
+                Thread(target=self._parser, args=(pool,), daemon=True)
+                for _ in range(self.parse_workers)
+            ]
+            for thread in threads:
+                thread.start()
+            Thread(target=_produce, daemon=True).start()
+            if self.report_interval is not None:
+                Thread(target=self._reporter, args=(start, done), daemon=True).start()
+
+            stage = self.stages[2]
+            produced = False
+            finished = 0
+            while not produced or finished < self._submitted:
+                event = self._results.get()
+                if event[0] == "produced":
+                    produced = True
+                    continue
+                t = monotonic()
+                persist(event)
+                if event[0] != "message":
+                    finished += 1
+                    stage.record(monotonic() - t)
+
+            for _ in range(self.fetch_workers):
+                self._jobs.put(None)
+            for _ in range(self.parse_workers):
+                self._pages.put(None)
+            for thread in threads:
+                thread.join()
+            done.append(True)
+
+        self.report(start)
+        if errors:
+            raise errors[0]
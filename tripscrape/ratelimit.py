@@ -0,0 +1,225 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from random import uniform
+from threading import Lock
+from time import monotonic
+
+
+class RetriesExhausted(Exception):
+    """
+    Raised when a request still fails after the maximum number of attempts.
+    """
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when requests to a host are suspended after too many consecutive failures.
+
+    Attributes
+    ----------
+    host : str
+        the suspended host
+    wait : float
+        the number of seconds until the circuit lets a trial request through
+    """
+
+    def __init__(self, host, wait):
+        super().__init__(host)
+        self.host = host
+        self.wait = wait
+
+
+class _Host:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.last = monotonic()
+        self.paused_until = 0.0
+        self.healthy = 0
+        self.failures = 0
+        self.open_until = 0.0
+
+
+class RateControl:
+    """
+    Central rate control for all requests of a scraper (thread-safe, per host).
+
+    Requests are spaced by a token bucket whose rate adapts to the responses: it grows by
+    `increase` after every `increase_every` healthy responses (up to `max_rate`) and is halved
+    on 429 and 5xx responses (down to `min_rate`). Failed requests are retried with exponential
+    backoff and full jitter, or after the server's Retry-After, at most `max_attempts` times.
+    After `failure_threshold` consecutive failures the circuit opens and no requests to the host
+    are let through for `cooldown` seconds, after which a single trial request is let through.
+
+    Attributes
+    ----------
+    rate : float
+        the initial number of requests per second per host
+    min_rate : float
+        the lowest rate the bucket is throttled to
+    max_rate : float
+        the highest rate the bucket is tuned up to
+    burst : int
+        the number of requests that may be sent back to back
+    increase : float
+        the rate increase after `increase_every` healthy responses
+    increase_every : int
+        the number of consecutive healthy responses between two rate increases
+    max_attempts : int
+        the maximum number of attempts per request
+    backoff_base : float
+        the backoff cap of the first retry in seconds (doubled with every retry)
+    backoff_max : float
+        the maximum backoff in seconds
+    failure_threshold : int
+        the number of consecutive failures that opens the circuit
+    cooldown : float
+        the number of seconds the circuit stays open
+    """
+
+    def __init__(
+        self,
+        rate=1 / 1.8,
+        min_rate=0.1,
+        max_rate=2.0,
+        burst=1,
+        increase=0.05,
+        increase_every=20,
+        max_attempts=5,
+        backoff_base=2.0,
+        backoff_max=120.0,
+        failure_threshold=10,
+        cooldown=300.0,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.increase_every = increase_every
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._hosts = {}
+        self._lock = Lock()
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = _Host(self.rate, self.burst)
+        return self._hosts[host]
+
+    def acquire(self, host):
+        """
+        Reserves the next request slot for a host.
+
+        Parameters
+        ----------
+        host : str
+            the host to be requested
+
+        Returns
+        -------
+        float
+            the number of seconds to wait before sending the request
+
+        Raises
+        ------
+        CircuitOpenError
+            if the circuit of the host is open
+        """
+        with self._lock:
+            h = self._host(host)
+            now = monotonic()
+            if now < h.open_until:
+                raise CircuitOpenError(host, h.open_until - now)
+            if h.failures >= self.failure_threshold:
+                # half-open: let a single trial request through
+                h.open_until = now + self.cooldown
+            h.tokens = min(self.burst, h.tokens + (now - h.last) * h.rate)
+            h.last = now
+            h.tokens -= 1
+            return max(0.0, -h.tokens / h.rate, h.paused_until - now)
+
+    def success(self, host):
+        """
+        Records a healthy response and tunes the rate of the host upward.
+
+        Parameters
+        ----------
+        host : str
+            the requested host
+        """
+        with self._lock:
+            h = self._host(host)
+            h.failures = 0
+            h.open_until = 0.0
+            h.healthy += 1
+            if h.healthy >= self.increase_every:
+                h.healthy = 0
+                h.rate = min(self.max_rate, h.rate + self.increase)
+
+    def failure(self, host, attempt, throttled=False, retry_after=None):
+        """
+        Records a failed request and returns the delay before it is retried.
+
+        Parameters
+        ----------
+        host : str
+            the requested host
+        attempt : int
+            the number of the failed attempt, starting at 0
+        throttled : bool
+            whether the server signalled overload (429 or 5xx), which halves the rate
+        retry_after : float
+            the number of seconds the server asked to wait, if any
+
+        Returns
+        -------
+        float
+            the number of seconds to wait before the next attempt
+        """
+        with self._lock:
+            h = self._host(host)
+            h.healthy = 0
+            h.failures += 1
+            now = monotonic()
+            if h.failures >= self.failure_threshold:
+                h.open_until = now + self.cooldown
+            if throttled:
+                h.rate = max(self.min_rate, h.rate / 2)
+            if retry_after is not None:
+                h.paused_until = max(h.paused_until, now + retry_after)
+                return retry_after
+            return uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+def retry_after(response):
+    """
+    Parses the Retry-After header of a response.
+
+    Parameters
+    ----------
+    response : requests.Response
+        a response
+
+    Returns
+    -------
+    float
+        the number of seconds to wait, or None if the header is missing or invalid
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
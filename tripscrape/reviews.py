@@ -1,15 +1,37 @@
+import argparse
+import asyncio
 import json
 import re
-from random import random
+from datetime import date, datetime
+from math import ceil
 from time import sleep
+from urllib.parse import urlsplit
 
 import psycopg2 as db
 from bs4 import BeautifulSoup as bs
 from dotenv import dotenv_values
-from requests import get
+from selenium.common.exceptions import WebDriverException
 
 import selenium_utils
+import web_context
+from cache import CacheMiss, add_cache_arguments, cache_from_args
+from dedup import add_dedup_arguments, dedup_from_args
+from fetcher import AsyncFetcher
+from metrics import METRICS, add_metrics_arguments, start_from_args
+from pipeline import Pipeline
+from ratelimit import RetriesExhausted
 from tripscrape import Attraction, Review, Scraper, User
+from work_queue import REMAINING_REVIEWS, LeaseLost, WorkQueue
+
+
+class MissingDetails(Exception):
+    """
+    Raised when the number of review pages of an attraction cannot be read.
+    """
+
+
+# errors that leave an attraction unscraped for the next run (or, for a worker, until its lease expires)
+SKIP_ERRORS = (RetriesExhausted, CacheMiss, MissingDetails)
 
 
 class ReviewScraper(Scraper):
@@ -29,6 +51,28 @@ class ReviewScraper(Scraper):
         the search type of the scraper (defaults to "reviews")
     attr_types : tuple
         the types of attributes to be scraped (defaults to ("Sights & Landmarks))
+    driver_pool : selenium_utils.DriverPool
+        a pool of reusable Chrome drivers (a new driver is started per attraction if None)
+    selenium_fallback : bool
+        whether to render attraction pages in Chrome if their details are missing from the __WEB_CONTEXT__ (defaults to False)
+    incremental : bool
+        whether to rescrape scraped attractions from their newest page until a known review is found (defaults to False)
+    largest_first : bool
+        whether to scrape the attractions with the most reviews left first instead of the newest ones (defaults to False)
+    pool_size : int
+        the number of connections kept alive per host
+    timeout : tuple
+        the (connect, read) timeout of every request in seconds
+    batch_size : int
+        the number of buffered writes that triggers a database flush
+    flush_interval : float
+        the number of seconds after which buffered writes are flushed
+    rate_control : ratelimit.RateControl
+        the rate limiter, backoff and circuit breaker of all requests (may be shared between scrapers)
+    cache : cache.ResponseCache
+        an optional on-disk cache of the responses
+    dedup : dedup.Dedup
+        optional filters of the users and reviews already stored, which are then not written again
     """
 
     def __init__(
@@ -39,10 +83,36 @@ class ReviewScraper(Scraper):
         base_url="https://www.tripadvisor.com",
         search_type="reviews",
         attr_types=("Sights & Landmarks"),
+        driver_pool=None,
+        selenium_fallback=False,
+        incremental=False,
+        largest_first=False,
+        pool_size=10,
+        timeout=(10, 30),
+        batch_size=500,
+        flush_interval=5.0,
+        rate_control=None,
+        cache=None,
+        dedup=None,
     ):
-        super().__init__(db_conn, place_id, base_url)
+        super().__init__(
+            db_conn,
+            place_id,
+            base_url,
+            pool_size,
+            timeout,
+            batch_size,
+            flush_interval,
+            rate_control,
+            cache,
+        )
         self.search_type = search_type
         self._attr_types = attr_types
+        self.driver_pool = driver_pool
+        self.selenium_fallback = selenium_fallback
+        self.incremental = incremental
+        self.largest_first = largest_first
+        self.dedup = dedup
         self.db_iter_conn = db_iter_conn
         self.db_iter_cur = db_iter_conn.cursor()
 
@@ -64,38 +134,83 @@ class ReviewScraper(Scraper):
 
     def read_attractions(self):
         """
-        Read attractions from the attractions table in the database.
+        Read attractions from the attractions table in the database, newest first or, with largest_first,
+        by their number of reviews left (from the stored num_reviews, e.g. after do_locate(); attractions
+        without it are read last). In incremental and cache-only mode, attractions that are already scraped
+        are read as well. Rows are (id, url, last_offset, scraped) tuples.
+        """
+        cache_only = self.cache is not None and self.cache.cache_only
+        conditions = [] if self.incremental or cache_only else ["scraped = False"]
+        conditions, params = self.filter_attr_types(conditions)
+
+        query_template = "SELECT id, url, last_offset, scraped FROM attractions"
+        if conditions:
+            query_template += " WHERE " + " AND ".join(conditions)
+        query_template += " ORDER BY "
+        if self.largest_first:
+            query_template += f"{REMAINING_REVIEWS} DESC NULLS LAST, "
+        query_template += '"id" DESC'
+
+        return self.db_iter_cur.execute(query_template, params)
+
+    def read_scraped_attractions(self):
+        """
+        Read scraped attractions and their stored number of reviews, least recently refreshed first.
+        """
+        conditions, params = self.filter_attr_types(["scraped = True"])
+        query_template = (
+            "SELECT id, url, num_reviews FROM attractions WHERE "
+            + " AND ".join(conditions)
+            + " ORDER BY last_refreshed NULLS FIRST"
+        )
+        return self.db_iter_cur.execute(query_template, params)
+
+    def filter_attr_types(self, conditions):
         """
-        query_template = "SELECT id, url FROM attractions WHERE scraped = False"
+        Adds the attr_types filter to a list of WHERE conditions.
 
+        Parameters
+        ----------
+        conditions : list
+            a list of SQL conditions
+
+        Returns
+        -------
+        tuple
+            a tuple of (conditions, query parameters)
+        """
         if self.attr_types == "all":
-            return self.db_iter_cur.execute(query_template)
-        elif len(self.attr_types) == 1:
-            query_template += (
-                ' WHERE attr_type IN (%s) AND scraped = False ORDER BY "id" DESC'
-            )
-            return self.db_iter_cur.execute(query_template, (self.attr_types,))
-        elif len(self.attr_types) > 1:
-            query_template += (
-                ' WHERE attr_type IN %s AND scraped = False ORDER BY "id" DESC'
-            )
-            # query_template += " WHERE id = 187676"
-            return self.db_iter_cur.execute(query_template, (self.attr_types,))
+            return conditions, ()
+        elif isinstance(self.attr_types, str):
+            return conditions + ["attr_type IN %s"], ((self.attr_types,),)
+        else:
+            return conditions + ["attr_type IN %s"], (tuple(self.attr_types),)
 
     def update_attraction(self, attr):
         """
-        Update an attraction in the PostgreSQL database
+        Update an attraction's location and number of reviews in the PostgreSQL database.
+        Details that could not be read (None) are left as stored.
 
         Parameters
         ----------
         attr: Attraction
             an Attraction instance
         """
+        assignments = []
+        params = []
+        if attr.location is not None and None not in attr.location:
+            assignments.append("geom = ST_SetSRID(ST_MakePoint(%s, %s),4326)")
+            params += [attr.location[1], attr.location[0]]
+        if attr.num_reviews is not None:
+            assignments.append("num_reviews = %s")
+            params.append(json.dumps(attr.num_reviews))
+        if not assignments:
+            return
+
         querystring = self.db_cur.mogrify(
-            """UPDATE attractions SET geom = ST_SetSRID(ST_MakePoint(%s, %s),4326), num_reviews = %s WHERE id = %s;""",
-            (attr.location[1], attr.location[0], json.dumps(attr.num_reviews), attr.ID),
+            "UPDATE attractions SET " + ", ".join(assignments) + " WHERE id = %s;",
+            params + [attr.ID],
         )
-
         return super().update_record(querystring)
 
     def update_review(self, review):
@@ -107,11 +222,12 @@ class ReviewScraper(Scraper):
         review: Review
             a Review instance
         """
-        querystring = self.db_cur.mogrify(
-            """INSERT INTO reviews (ID, title, rating, date, "full", attr_ID, user_profile) VALUES (%s, %s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING;""",
-            tuple(review.__dict__.values()),
+        if self.dedup is not None and self.dedup.reviews.seen(review.ID):
+            return
+        return super().insert_row(
+            """INSERT INTO reviews (ID, title, rating, date, "full", attr_ID, user_profile, published_date) VALUES %s ON CONFLICT DO NOTHING;""",
+            review.as_row(),
         )
-        return super().update_record(querystring)
 
     def update_user(self, user):
         """
@@ -122,32 +238,107 @@ class ReviewScraper(Scraper):
         user: User
             a User instance
         """
-        print("Updating user {}".format(user.profile))
         if user.profile != None:
-            querystring = self.db_cur.mogrify(
-                """INSERT INTO users (profile, location, contributions, helpful_votes) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING""",
-                tuple(user.__dict__.values()),
+            if self.dedup is not None and self.dedup.users.seen(user.profile):
+                return
+            return super().insert_row(
+                """INSERT INTO users (profile, location, contributions, helpful_votes) VALUES %s ON CONFLICT DO NOTHING""",
+                user.as_row(),
             )
-            return super().update_record(querystring)
         else:
-            print("Empty user information")
+            METRICS.count("empty_users")
             return
 
+    def close(self):
+        """
+        Reports the hit rate of the duplicate filters, flushes all buffered writes and closes the HTTP session and the cache
+        """
+        if self.dedup is not None:
+            self.dedup.report()
+        return super().close()
+
     def get_attr_details(self, url):
         """
-        Wrapper method for selenium_utils.get_attr_details()
+        Reads an attraction's details from the __WEB_CONTEXT__ of its first review page.
+        Falls back to selenium_utils.get_attr_details() for the missing details if enabled; details
+        that Chrome fails to render are left missing.
+
+        Parameters
+        ----------
+        url : str
+            the attraction's url
+
+        Returns
+        -------
+        attraction details : tuple
+            a tuple of (coordinates, number of reviews, number of pages); each detail is None if it
+            could not be read
+
+        Raises
+        ------
+        ratelimit.RetriesExhausted
+            if the page could not be retrieved
+        cache.CacheMiss
+            if the page is not cached and the cache is in cache-only mode
+        """
+        match = re.search(r"-d(\d+)-", url)
+        attr_ID = int(match.group(1)) if match else None
+        text = self.fetch(url).text
+        try:
+            with METRICS.time("attr_details_seconds"):
+                details = web_context.get_attr_details(web_context.parse(text), attr_ID)
+        except ValueError:
+            details = (None, None, None)
+        if None in details:
+            # the next attempt fetches the page again instead of reading the same incomplete one
+            self.discard(url)
+
+        if None in details and self.selenium_fallback:
+            try:
+                with METRICS.time("selenium_attr_details_seconds"):
+                    fallback = selenium_utils.get_attr_details(
+                        url, pool=self.driver_pool
+                    )
+            except WebDriverException as e:
+                # e.g. a page load timeout or a driver that cannot be started
+                METRICS.count("selenium_errors")
+                METRICS.log("selenium error", f"Rendering {url} failed: {e!r}")
+                fallback = (None, None, None)
+            details = tuple(d if d is not None else f for d, f in zip(details, fallback))
+        if None in details:
+            METRICS.count("incomplete_attr_details")
+            print(f"Incomplete attraction details at {url}: {details}")
+        return details
+
+    def read_details(self, attr, url):
+        """
+        Reads an attraction's details into the passed Attraction.
 
         Parameters
         ----------
+        attr : Attraction
+            an Attraction instance, whose location and num_reviews are set
         url : str
             the attraction's url
 
+        Returns
+        -------
+        int
+            the number of review pages
+
+        Raises
+        ------
+        MissingDetails
+            if the number of review pages could not be read
         """
-        return selenium_utils.get_attr_details(url)
+        attr.location, attr.num_reviews, number_of_pages = self.get_attr_details(url)
+        if number_of_pages is None:
+            raise MissingDetails(url)
+        return number_of_pages
 
     def print_missing_info(self, info_type, attr_ID, page_no, review_no, url):
         """
-        Prints a message to stdout about missing information
+        Counts missing information by type and prints a message about it (at most one per type every 10 seconds)
 
         Parameters
         ----------
@@ -162,15 +353,18 @@ class ReviewScraper(Scraper):
         url : str
             the currently scraped attraction url
         """
-        print(
+        METRICS.count("missing_fields", info_type)
+        METRICS.log(
+            "missing " + info_type,
             "No {} found at attraction {}, page {}, review {}.\nURL: {}".format(
                 info_type, attr_ID, page_no + 1, review_no + 1, url
-            )
+            ),
         )
 
     def set_scraped(self, attr, boolean):
         """
         Sets the passed attraction's scraped column to the specified boolean value in the PostgreSQL data base.
+        All buffered writes are flushed in the same transaction, so the flag is only committed together with the attraction's reviews.
 
         Parameters
         ----------
@@ -179,11 +373,141 @@ class ReviewScraper(Scraper):
         boolean : bool
             a boolean value
         """
-        query_template = "UPDATE attractions SET scraped = %s WHERE id = %s;"
+        query_template = (
+            "UPDATE attractions SET scraped = %s, last_offset = NULL, scraped_at = now() WHERE id = %s;"
+        )
         querystring = self.db_cur.mogrify(query_template, (boolean, attr.ID))
         print(f"{attr.ID} scraped set to {boolean}")
+        super().update_record(querystring)
+        return super().flush()
+
+    def set_checkpoint(self, attr, index):
+        """
+        Records the offset of the last completed review page of an attraction.
+        The checkpoint is buffered like the page's reviews and committed in the same transaction.
+
+        Parameters
+        ----------
+        attr : Attraction
+            an Attraction instance
+        index : int
+            the index of the last completed review page
+        """
+        query_template = "UPDATE attractions SET last_offset = %s WHERE id = %s;"
+        querystring = self.db_cur.mogrify(query_template, (index * 5, attr.ID))
+        return super().update_record(querystring)
+
+    def set_chunk_checkpoint(self, attr, first_page, next_page, owner):
+        """
+        Records the first page of a chunk that is not scraped yet, committed with the chunk's reviews like set_checkpoint().
+        The checkpoint is only recorded while the worker still holds the chunk's lease.
+
+        Parameters
+        ----------
+        attr : Attraction
+            an Attraction instance
+        first_page : int
+            the first page of the chunk
+        next_page : int
+            the index following the last completed review page
+        owner : str
+            the id of the worker holding the chunk's lease
+        """
+        query_template = "UPDATE attraction_chunks SET next_page = %s WHERE attr_id = %s AND first_page = %s AND lease_owner = %s;"
+        querystring = self.db_cur.mogrify(
+            query_template, (next_page, attr.ID, first_page, owner)
+        )
         return super().update_record(querystring)
 
+    def set_chunk_done(self, attr, first_page, owner):
+        """
+        Marks a chunk of an attraction as done and, once all of its chunks are done, sets the attraction's
+        scraped column like set_scraped(). All buffered writes are flushed in the same transaction; the
+        attraction row is locked first, so that of several workers finishing its last chunks one sees all done.
+        A chunk whose lease was lost to another worker is left open for that worker.
+
+        Parameters
+        ----------
+        attr : Attraction
+            an Attraction instance
+        first_page : int
+            the first page of the chunk
+        owner : str
+            the id of the worker holding the chunk's lease
+        """
+        for query_template, params in (
+            ("SELECT 1 FROM attractions WHERE id = %s FOR UPDATE;", (attr.ID,)),
+            (
+                "UPDATE attraction_chunks SET done = True, lease_owner = NULL, lease_expires = NULL WHERE attr_id = %s AND first_page = %s AND lease_owner = %s;",
+                (attr.ID, first_page, owner),
+            ),
+            (
+                """UPDATE attractions SET scraped = True, last_offset = NULL, scraped_at = now()
+                WHERE id = %s AND NOT EXISTS (SELECT 1 FROM attraction_chunks WHERE attr_id = %s AND NOT done);""",
+                (attr.ID, attr.ID),
+            ),
+        ):
+            super().update_record(self.db_cur.mogrify(query_template, params))
+        print(f"{attr.ID}: chunk {first_page} done")
+        return super().flush()
+
+    def set_refreshed(self, attr):
+        """
+        Sets the passed attraction's last_refreshed column to the current time and flushes all buffered writes in the same transaction.
+
+        Parameters
+        ----------
+        attr : Attraction
+            an Attraction instance
+        """
+        query_template = "UPDATE attractions SET last_refreshed = now() WHERE id = %s;"
+        querystring = self.db_cur.mogrify(query_template, (attr.ID,))
+        super().update_record(querystring)
+        return super().flush()
+
+    def count_new_pages(self, old, new):
+        """
+        Computes the number of review pages holding the reviews added since the stored counts.
+        New reviews are listed first, so these are the attraction's first pages.
+
+        Parameters
+        ----------
+        old : dict
+            the stored number of reviews per language
+        new : dict
+            the current number of reviews per language
+
+        Returns
+        -------
+        int
+            the number of pages to be scraped, or None if the counts cannot be compared
+        """
+        if not old or not new or not set(old) & set(new):
+            return None
+        added = sum(max(0, v - old.get(k, 0)) for k, v in new.items())
+        return ceil(added / 5)
+
+    def has_reviews(self, review_IDs):
+        """
+        Checks whether any of the passed reviews are already stored in the database.
+
+        Parameters
+        ----------
+        review_IDs : list
+            a list of TripAdvisor review ids
+
+        Returns
+        -------
+        bool
+            True if at least one of the reviews is stored
+        """
+        if not review_IDs:
+            return False
+        self.db_cur.execute(
+            "SELECT 1 FROM reviews WHERE id = ANY(%s) LIMIT 1;", (list(review_IDs),)
+        )
+        return self.db_cur.fetchone() is not None
+
     def traverse(self, val):
         """
         Traverses a nested dictionary and finds any review dictionaries
@@ -204,10 +528,121 @@ class ReviewScraper(Scraper):
             for v in val:
                 yield from self.traverse(v)
 
-    def scrape_page(self, url, attr_ID, index):
+    def parse_page(self, text):
+        """
+        Extracts the review lists from the __WEB_CONTEXT__ of a review page.
+
+        Parameters
+        ----------
+        text : str
+            the html of a review page
+
+        Returns
+        -------
+        list
+            the review lists found in the page (empty if none were found)
+        """
+        with METRICS.time("web_context_seconds"):
+            data = web_context.parse(text)
+        with METRICS.time("find_reviews_seconds"):
+            return web_context.find_reviews(data)
+
+    def fetch_reviews(self, url, index):
+        """
+        Retrieves a review page, retrying with backoff until its review lists could be parsed.
+
+        url : str
+            a review page url
+        index : int
+            the current page of the attraction's reviews
+
+        Returns
+        -------
+        list
+            the review lists returned by parse_page(), or None if the page is unchanged since
+            it was last fetched (and so already stored)
+
+        Raises
+        ------
+        ratelimit.RetriesExhausted
+            if the page could not be retrieved or parsed within max_attempts attempts
+        """
+        for attempt in range(self.rate_control.max_attempts):
+            response = self.fetch(url)
+            if getattr(response, "unchanged", False):
+                return None
+            review_lists = self.try_parse_page(response, index)
+            if review_lists:
+                return review_lists
+            self.discard(url)
+            delay = self.rate_control.failure(urlsplit(url).netloc, attempt)
+            if attempt + 1 < self.rate_control.max_attempts:
+                sleep(delay)
+        raise RetriesExhausted(url)
+
+    def try_parse_page(self, response, index):
+        """
+        Parses a review page, reporting pages without review lists.
+
+        response : requests.Response
+            the response of a review page
+        index : int
+            the current page of the attraction's reviews
+
+        Returns
+        -------
+        list
+            the review lists returned by parse_page(), or None if there were none
+        """
+        try:
+            review_lists = self.parse_page(response.text)
+        except ValueError:
+            METRICS.count("page_retries", "no web context")
+            METRICS.log("reloading", f"Reloading {response.url}...")
+            return None
+        if not review_lists:
+            METRICS.count("page_retries", "no reviews")
+            METRICS.log("no reviews", f"Weird stuff happening at {index}; retrying...")
+            return None
+        return review_lists
+
+    def scrape_page(self, url, attr_ID, index, check_known=False):
         """
         Retrieves the web page from the passed url and scrapes it.
+        Pages unchanged since they were last fetched are neither parsed nor stored again.
+
+        url : str
+            an attraction url
+        attr_id : int
+            a TripAdvisor attraction id
+        index : int
+            the current page of the attraction's reviews
+        check_known : bool
+            whether to check if any of the page's reviews are already stored
+
+        Returns
+        -------
+        bool
+            whether any of the page's reviews were already stored before (False if not checked)
+        """
+        METRICS.log("page", "Scraping page {}".format(url))
 
+        review_lists = self.fetch_reviews(url, index)
+        if review_lists is None:
+            METRICS.log("unchanged", f"Skipping unchanged page {url}")
+            return check_known
+        known = check_known and self.has_reviews(
+            [r["id"] for reviews in review_lists if reviews for r in reviews]
+        )
+        self.process_reviews(review_lists, attr_ID, index, url)
+        return known
+
+    async def scrape_page_async(self, fetcher, url, attr_ID, index):
+        """
+        Asynchronous version of scrape_page(), fetching through an AsyncFetcher.
+
+        fetcher : fetcher.AsyncFetcher
+            the fetcher shared by all pages in flight
         url : str
             an attraction url
         attr_id : int
@@ -215,118 +650,769 @@ class ReviewScraper(Scraper):
         index : int
             the current page of the attraction's reviews
         """
-        print("Scraping page {}".format(url))
+        METRICS.log("page", "Scraping page {}".format(url))
+
+        for attempt in range(self.rate_control.max_attempts):
+            response = await fetcher.fetch(url)
+            if getattr(response, "unchanged", False):
+                METRICS.log("unchanged", f"Skipping unchanged page {url}")
+                return
+            review_lists = self.try_parse_page(response, index)
+            if review_lists:
+                return self.process_reviews(review_lists, attr_ID, index, url)
+            await asyncio.get_running_loop().run_in_executor(None, self.discard, url)
+            delay = self.rate_control.failure(urlsplit(url).netloc, attempt)
+            if attempt + 1 < self.rate_control.max_attempts:
+                await asyncio.sleep(delay)
+        raise RetriesExhausted(url)
+
+    def process_reviews(self, review_lists, attr_ID, index, url):
+        """
+        Stores the reviews and users of the review lists of a page.
 
+        review_lists : list
+            the review lists returned by parse_page()
+        attr_id : int
+            a TripAdvisor attraction id
+        index : int
+            the current page of the attraction's reviews
+        url : str
+            the url of the page
+        """
+        self.store_reviews(read_reviews(review_lists, attr_ID), attr_ID, index, url)
+
+    def store_reviews(self, page, attr_ID, index, url):
+        """
+        Stores the reviews and users read by read_reviews() and reports their missing information.
+
+        page : tuple
+            the (records, missing) tuple returned by read_reviews()
+        attr_id : int
+            a TripAdvisor attraction id
+        index : int
+            the current page of the attraction's reviews
+        url : str
+            the url of the page
+        """
+        records, missing = page
+        for info_type, ridx in missing:
+            self.print_missing_info(info_type, attr_ID, index, ridx, url)
+        for review, user in records:
+            self.update_user(user)
+            self.update_review(review)
+        self.mark_stored(url)
+        METRICS.count("pages")
+        METRICS.count("reviews", n=len(records))
+
+    def scrape_attraction(self, row, heartbeat=None, incremental=False):
+        """
+        Scrapes the details and all review pages of an attraction and marks it as scraped.
+
+        Parameters
+        ----------
+        row : tuple
+            an (id, url, last_offset) row of the attractions table
+        heartbeat : callable
+            an optional function taking the attraction id, called after every page,
+            that returns False if the attraction's lease was lost
+        incremental : bool
+            whether to scrape from the newest page until a known review is found, without checkpoints
+            (only for attractions that were completely scraped before)
+
+        Raises
+        ------
+        work_queue.LeaseLost
+            if the heartbeat failed, before the page is checkpointed
+        """
+        current_url = self.base_url + row[1]
+        a = Attraction(row[0])
+        number_of_pages = self.read_details(a, current_url)
+        print(a.location, a.num_reviews, number_of_pages)
+        self.update_attraction(a)
+
+        links = self.generate_page_links(current_url, number_of_pages)
+        start = 0 if incremental else self.resume_index(row)
+
+        for index, link in enumerate(links[start:], start):
+            known = self.scrape_page(link, a.ID, index, check_known=incremental)
+            if heartbeat is not None and not heartbeat(a.ID):
+                raise LeaseLost(a.ID)
+            if known:
+                print(f"Reached known reviews of {a.ID} at page {index + 1}")
+                break
+            elif not incremental:
+                self.set_checkpoint(a, index)
+
+        self.set_scraped(a, True)
+
+    def resume_index(self, row):
+        """
+        Returns the index of the first review page of an attraction that still has to be scraped.
+
+        Parameters
+        ----------
+        row : tuple
+            an (id, url, last_offset) row of the attractions table
+
+        Returns
+        -------
+        int
+            the page index following the checkpoint, or 0 without checkpoint
+        """
+        if row[2] is None:
+            return 0
+        print(f"Resuming {row[0]} after offset {row[2]}")
+        return row[2] // 5 + 1
+
+    def do_scrape(self):
+        """
+        Retrieves the attractions to be scraped, scrapes its details, and then proceeds to scrape all of its reviews.
+        Attractions with pages that cannot be retrieved are left unscraped for the next run.
+        In incremental mode, only attractions that were completely scraped before are rescraped until a
+        known review is found; unscraped ones are scraped from their checkpoint like in a full run.
+        """
+        self.read_attractions()
         while True:
+            row = self.db_iter_cur.fetchone()
+
+            if row == None:
+                break
+
             try:
-                text = get(url).text
-                data = re.search(r"window\.__WEB_CONTEXT__=(.*?});", text).group(1)
-            except:
-                print(f"Reloading {url}...")
-                sleep(1)
-                continue
-            break
+                self.scrape_attraction(row, incremental=self.incremental and row[3])
+            except SKIP_ERRORS as e:
+                print(f"Skipping attraction {row[0]}, giving up on {e!r}")
+
+    def split_attraction(self, row, queue):
+        """
+        Scrapes the details of a claimed attraction and splits its remaining review pages into chunks.
 
-        data = data.replace("pageManifest", '"pageManifest"')
-        data = json.loads(data)
+        Parameters
+        ----------
+        row : tuple
+            an (id, url, last_offset) row of the attractions table
+        queue : work_queue.WorkQueue
+            the work queue the attraction was claimed from
 
-        traverser = self.traverse(data)
+        Raises
+        ------
+        work_queue.LeaseLost
+            if the attraction's lease was lost while its details were read
+        """
+        current_url = self.base_url + row[1]
+        a = Attraction(row[0])
+        number_of_pages = self.read_details(a, current_url)
+        self.update_attraction(a)
+        self.flush()
 
-        _exhausted = object()
+        chunks = queue.split(a.ID, self.resume_index(row), number_of_pages)
+        print(f"{a.ID}: {number_of_pages} pages in {chunks} chunks")
+        if chunks == 0:
+            self.set_scraped(a, True)
 
-        while next(traverser, _exhausted) == _exhausted:
-            print(f"Weird stuff happening at {index}; retrying...")
-            text = get(url).text
-            data = re.search(r"window\.__WEB_CONTEXT__=(.*?});", text).group(1)
-            data = data.replace("pageManifest", '"pageManifest"')
-            data = json.loads(data)
-            traverser = self.traverse(data)
+    def scrape_chunk(self, chunk, queue):
+        """
+        Scrapes the review pages of a claimed chunk, from its checkpoint on, and marks it as done.
+        The chunk's lease is renewed after every page.
 
-        for reviews in self.traverse(data):
-            if reviews:
-                for ridx, r in enumerate(reviews):
-                    review = Review()
-                    user = User()
+        Parameters
+        ----------
+        chunk : tuple
+            an (attr_id, url, first_page, end_page, next_page) row returned by WorkQueue.claim_chunk()
+        queue : work_queue.WorkQueue
+            the work queue the chunk was claimed from
 
-                    review.ID = r["id"]
-                    review.title = r["title"]
-                    review.rating = r["rating"]
-                    review.full = r["text"]
-                    review.attr_ID = attr_ID
+        Raises
+        ------
+        work_queue.LeaseLost
+            if the chunk's lease was lost, before the page is checkpointed
+        """
+        attr_ID, url, first_page, end_page, next_page = chunk
+        a = Attraction(attr_ID)
+        links = self.generate_page_links(self.base_url + url, end_page)
 
-                    review.date = r["publishedDate"]
-                    try:
-                        review.user_profile = r["userProfile"]["route"]["url"]
-                        user.profile = review.user_profile
-                    except:
-                        self.print_missing_info(
-                            "user profile", attr_ID, index, ridx, url
-                        )
+        for index, link in enumerate(links[next_page:end_page], next_page):
+            self.scrape_page(link, a.ID, index)
+            if not queue.heartbeat(a.ID, first_page):
+                raise LeaseLost(a.ID, first_page)
+            self.set_chunk_checkpoint(a, first_page, index + 1, queue.worker_id)
+        self.set_chunk_done(a, first_page, queue.worker_id)
 
-                    try:
-                        user.location = json.dumps(r["userProfile"]["hometown"])
-                    except:
-                        self.print_missing_info(
-                            "user location", attr_ID, index, ridx, url
-                        )
+    def do_work(self, queue):
+        """
+        Worker version of do_scrape(): claims attractions from a shared work queue until it is empty,
+        so that any number of processes or hosts can scrape the same attractions table.
+        With chunks, open chunks are claimed first and claimed attractions are only split into chunks,
+        so that the pages of a large attraction are scraped by all workers at once.
 
+        Parameters
+        ----------
+        queue : work_queue.WorkQueue
+            the work queue to claim attractions from
+        """
+        if queue.chunk_pages is not None and self.incremental:
+            raise ValueError(
+                "The incremental mode requires pages to be scraped in order"
+            )
+
+        while True:
+            if queue.chunk_pages is not None:
+                chunk = queue.claim_chunk()
+                if chunk is not None:
                     try:
-                        user.contributions = r["userProfile"]["contributionCounts"][
-                            "sumAllUgc"
-                        ]
-                    except:
-                        self.print_missing_info(
-                            "user contributions", attr_ID, index, ridx, url
+                        self.scrape_chunk(chunk, queue)
+                    except SKIP_ERRORS as e:
+                        # the lease is kept, so the chunk is retried once it expires
+                        print(
+                            f"Skipping chunk {chunk[2]} of {chunk[0]}, giving up on {e!r}"
                         )
+                    except LeaseLost:
+                        # another worker owns the chunk now and scrapes it from its checkpoint
+                        print(f"Abandoning chunk {chunk[2]} of {chunk[0]}")
+                    continue
 
-                    try:
-                        user.helpful_votes = r["userProfile"]["contributionCounts"][
-                            "helpfulVote"
-                        ]
-                    except:
-                        self.print_missing_info("helpful", attr_ID, index, ridx, url)
+            row = queue.claim()
 
-                    self.update_user(user)
-                    self.update_review(review)
+            if row == None:
+                break
 
-            else:
-                self.print_missing_info("reviews", attr_ID, index, -2, url)
+            try:
+                if queue.chunk_pages is not None:
+                    self.split_attraction(row, queue)
+                    continue
+                self.scrape_attraction(row, heartbeat=queue.heartbeat)
+            except SKIP_ERRORS as e:
+                # the lease is kept, so the attraction is retried once it expires
+                print(f"Skipping attraction {row[0]}, giving up on {e!r}")
+                continue
+            except LeaseLost:
+                # another worker owns the attraction now and scrapes it from its checkpoint
+                print(f"Abandoning attraction {row[0]}")
+                continue
+            queue.release(row[0])
 
-    def do_scrape(self):
+    def do_locate(self):
         """
-        Retrieves the attractions to be scraped, scrapes its details, and then proceeds to scrape all of its reviews.
+        Reads and stores the details (coordinates and number of reviews) of unscraped attractions
+        without coordinates, so that the work queue can schedule them by tile. With a cache, their
+        first review pages are not fetched again when the attractions are scraped.
         """
-        self.read_attractions()
+        conditions, params = self.filter_attr_types(["scraped = False", "geom IS NULL"])
+        self.db_iter_cur.execute(
+            "SELECT id, url FROM attractions WHERE " + " AND ".join(conditions), params
+        )
         while True:
             row = self.db_iter_cur.fetchone()
 
             if row == None:
                 break
 
-            current_url = self.base_url + row[1]
             a = Attraction(row[0])
-            a.location, a.num_reviews, number_of_pages = self.get_attr_details(
-                current_url
-            )
-            print(a.location, a.num_reviews, number_of_pages)
+            try:
+                a.location, a.num_reviews, _ = self.get_attr_details(
+                    self.base_url + row[1]
+                )
+            except SKIP_ERRORS as e:
+                print(f"Skipping attraction {row[0]}, giving up on {e!r}")
+                continue
             self.update_attraction(a)
+            METRICS.count("located_attractions")
+        self.flush()
 
+    def do_refresh(self):
+        """
+        Compares the current number of reviews of all scraped attractions with the stored ones
+        and scrapes only the new review pages of attractions whose counts grew, largest growth first.
+        Attractions whose counts cannot be compared are scraped from their newest page until a known review is found.
+        Attractions whose details cannot be read are skipped and keep their stored details and last_refreshed time.
+        """
+        self.read_scraped_attractions()
+        schedule = []
+        while True:
+            row = self.db_iter_cur.fetchone()
+
+            if row == None:
+                break
+
+            current_url = self.base_url + row[1]
+            a = Attraction(row[0])
+            try:
+                number_of_pages = self.read_details(a, current_url)
+            except SKIP_ERRORS as e:
+                print(f"Skipping attraction {a.ID}, giving up on {e!r}")
+                continue
+            if a.num_reviews is None:
+                print(f"Skipping attraction {a.ID}, its number of reviews is unknown")
+                continue
+            new_pages = self.count_new_pages(row[2], a.num_reviews)
+
+            if new_pages == 0:
+                self.set_refreshed(a)
+            else:
+                print(f"{a.ID}: {new_pages} new pages")
+                schedule.append((current_url, a, number_of_pages, new_pages))
+
+        schedule.sort(key=lambda s: -1 if s[3] is None else s[3], reverse=True)
+
+        for current_url, a, number_of_pages, new_pages in schedule:
             links = self.generate_page_links(current_url, number_of_pages)
+            if new_pages is not None:
+                links = links[:new_pages]
 
-            for index, link in enumerate(links):
-                self.scrape_page(link, a.ID, index)
-                sleep(1.3 + random())
+            try:
+                for index, link in enumerate(links):
+                    known = self.scrape_page(
+                        link, a.ID, index, check_known=new_pages is None
+                    )
+                    if known:
+                        break
+            except SKIP_ERRORS as e:
+                print(f"Skipping attraction {a.ID}, giving up on {e!r}")
+                continue
 
-            self.set_scraped(a, True)
+            self.update_attraction(a)
+            self.set_refreshed(a)
+
+    async def scrape_attraction_async(self, fetcher, row):
+        """
+        Scrapes the details and all review pages of an attraction, with its pages fetched concurrently.
+
+        Parameters
+        ----------
+        fetcher : fetcher.AsyncFetcher
+            the fetcher shared by all attractions in flight
+        row : tuple
+            an (id, url, last_offset) row of the attractions table
+        """
+        loop = asyncio.get_running_loop()
+        current_url = self.base_url + row[1]
+        a = Attraction(row[0])
+        number_of_pages = await loop.run_in_executor(
+            None, self.read_details, a, current_url
+        )
+        print(a.location, a.num_reviews, number_of_pages)
+        self.update_attraction(a)
+
+        links = self.generate_page_links(current_url, number_of_pages)
+        start = self.resume_index(row)
+        completed = set()
+        checkpoint = start - 1
+
+        async def _scrape(index, link):
+            nonlocal checkpoint
+            await self.scrape_page_async(fetcher, link, a.ID, index)
+            completed.add(index)
+            if checkpoint + 1 in completed:
+                while checkpoint + 1 in completed:
+                    checkpoint += 1
+                self.set_checkpoint(a, checkpoint)
+
+        results = await asyncio.gather(
+            *(_scrape(index, link) for index, link in enumerate(links[start:], start)),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        self.set_scraped(a, True)
+
+    async def do_scrape_async(self, max_attractions=4, max_per_host=4):
+        """
+        Asynchronous version of do_scrape(), keeping the review pages of several attractions in flight at once.
+        Requests are paced by the scraper's rate control.
+        Pages are fetched out of order, so the incremental mode is not supported here.
+
+        Parameters
+        ----------
+        max_attractions : int
+            the maximum number of attractions scraped concurrently
+        max_per_host : int
+            the maximum number of concurrent requests per host
+        """
+        if self.incremental:
+            raise ValueError(
+                "The incremental mode requires pages to be scraped in order"
+            )
+
+        fetcher = AsyncFetcher(max_per_host=max_per_host, get=self.fetch)
+        slots = asyncio.Semaphore(max_attractions)
+        tasks = []
+
+        async def _scrape(row):
+            try:
+                await self.scrape_attraction_async(fetcher, row)
+            except SKIP_ERRORS as e:
+                print(f"Skipping attraction {row[0]}, giving up on {e!r}")
+            finally:
+                slots.release()
+
+        self.read_attractions()
+        while True:
+            await slots.acquire()
+            row = self.db_iter_cur.fetchone()
+
+            if row == None:
+                break
+
+            tasks.append(asyncio.create_task(_scrape(row)))
+
+        await asyncio.gather(*tasks)
+
+    def do_scrape_pipelined(self, fetch_workers=4, parse_workers=2, queue_size=32):
+        """
+        Pipelined version of do_scrape(): review pages are fetched by a pool of threads, parsed by a pool
+        of processes and stored by the current thread, with bounded queues between the stages.
+        Requests are paced by the scraper's rate control and an attraction is only marked as scraped
+        once all of its pages are stored. Pages complete out of order, so the incremental mode is not supported here.
+
+        Parameters
+        ----------
+        fetch_workers : int
+            the number of fetcher threads
+        parse_workers : int
+            the number of parser processes
+        queue_size : int
+            the capacity of the queues between the stages
+        """
+        if self.incremental:
+            raise ValueError(
+                "The incremental mode requires pages to be scraped in order"
+            )
+
+        pipeline = Pipeline(
+            self.fetch,
+            parse_review_page,
+            self.rate_control,
+            fetch_workers=fetch_workers,
+            parse_workers=parse_workers,
+            queue_size=queue_size,
+            discard=self.discard,
+        )
+        # attraction id -> [attraction, pages left, completed pages, checkpoint, failed]
+        attractions = {}
+
+        def _produce(pipeline):
+            # runs in a separate thread, so it only uses the iteration connection
+            self.read_attractions()
+            while True:
+                row = self.db_iter_cur.fetchone()
+
+                if row == None:
+                    break
+
+                current_url = self.base_url + row[1]
+                a = Attraction(row[0])
+                try:
+                    number_of_pages = self.read_details(a, current_url)
+                except SKIP_ERRORS as e:
+                    print(f"Skipping attraction {a.ID}, giving up on {e!r}")
+                    continue
+                print(a.location, a.num_reviews, number_of_pages)
+                links = self.generate_page_links(current_url, number_of_pages)
+                start = self.resume_index(row)
+                pipeline.emit((a, len(links) - start, start - 1))
+                for index, link in enumerate(links[start:], start):
+                    pipeline.submit(link, (a.ID, index))
+
+        def _persist(event):
+            if event[0] == "message":
+                a, pages, checkpoint = event[1]
+                self.update_attraction(a)
+                attractions[a.ID] = state = [a, pages, set(), checkpoint, False]
+            else:
+                job = event[1]
+                attr_ID, index = job.context
+                state = attractions[attr_ID]
+                state[1] -= 1
+                if event[0] in ("page", "unchanged"):
+                    if event[0] == "page":
+                        METRICS.log("page", "Scraped page {}".format(job.url))
+                        self.store_reviews(event[2], attr_ID, index, job.url)
+                    state[2].add(index)
+                    if not state[4] and state[3] + 1 in state[2]:
+                        while state[3] + 1 in state[2]:
+                            state[3] += 1
+                        self.set_checkpoint(state[0], state[3])
+                elif not state[4]:
+                    print(f"Skipping attraction {attr_ID}, giving up on {event[2]}")
+                    state[4] = True
+
+            if state[1] == 0:
+                del attractions[state[0].ID]
+                if not state[4]:
+                    self.set_scraped(state[0], True)
+
+        pipeline.run(_produce, _persist)
+        self.flush()
+
+
+def read_reviews(review_lists, attr_ID):
+    """
+    Builds the Review and User instances of the review lists of a page, each with a single constructor call.
+
+    Parameters
+    ----------
+    review_lists : list
+        the review lists returned by ReviewScraper.parse_page()
+    attr_ID : int
+        a TripAdvisor attraction id
+
+    Returns
+    -------
+    tuple
+        a tuple of (list of (Review, User) tuples, list of (missing information type, review index) tuples)
+    """
+    records = []
+    missing = []
+    for reviews in review_lists:
+        if reviews:
+            for ridx, r in enumerate(reviews):
+                try:
+                    user_profile = r["userProfile"]["route"]["url"]
+                except:
+                    user_profile = None
+                    missing.append(("user profile", ridx))
+
+                try:
+                    location = json.dumps(r["userProfile"]["hometown"])
+                except:
+                    location = None
+                    missing.append(("user location", ridx))
+
+                try:
+                    contributions = r["userProfile"]["contributionCounts"]["sumAllUgc"]
+                except:
+                    contributions = None
+                    missing.append(("user contributions", ridx))
+
+                try:
+                    helpful_votes = r["userProfile"]["contributionCounts"]["helpfulVote"]
+                except:
+                    helpful_votes = None
+                    missing.append(("helpful", ridx))
+
+                records.append(
+                    (
+                        Review(
+                            r["id"],
+                            r["title"],
+                            r["rating"],
+                            r["publishedDate"],
+                            r["text"],
+                            attr_ID,
+                            user_profile,
+                            parse_review_date(r["publishedDate"]),
+                        ),
+                        User(user_profile, location, contributions, helpful_votes),
+                    )
+                )
+
+        else:
+            missing.append(("reviews", -2))
+    return records, missing
+
+
+def parse_review_date(value):
+    """
+    Parses the date string of a review like migration 005 does for stored reviews.
+
+    Parameters
+    ----------
+    value : str
+        an ISO date (the publishedDate of the __WEB_CONTEXT__) or a "Month YYYY" date of older scrapes
+
+    Returns
+    -------
+    datetime.date
+        the date (the first of the month for "Month YYYY" dates), or None if the format is unknown
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%B %Y").date()
+    except ValueError:
+        return None
+
+
+def parse_review_page(text, context):
+    """
+    Parses a review page into its reviews and users (run in the parser processes of do_scrape_pipelined()).
+
+    Parameters
+    ----------
+    text : str
+        the html of a review page
+    context : tuple
+        the (attraction id, page index) of the page
+
+    Returns
+    -------
+    tuple
+        the (records, missing) tuple returned by read_reviews()
+
+    Raises
+    ------
+    ValueError
+        if the page contains no __WEB_CONTEXT__ or no review lists, so that it is fetched again
+    """
+    review_lists = web_context.find_reviews(web_context.parse(text))
+    if not review_lists:
+        raise ValueError("No reviews found")
+    return read_reviews(review_lists, context[0])
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Scrape TripAdvisor reviews")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="claim attractions from the shared work queue instead of iterating over all of them",
+    )
+    parser.add_argument("--worker-id", help="the worker name (defaults to host:pid)")
+    parser.add_argument(
+        "--lease", type=int, default=300, help="the lease of a claim in seconds"
+    )
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+        help="claim only attractions within a bounding box (with --worker)",
+    )
+    parser.add_argument(
+        "--tile-precision",
+        type=int,
+        help="claim attractions tile by tile, with tiles of this many geohash characters (with --worker)",
+    )
+    parser.add_argument(
+        "--locate",
+        action="store_true",
+        help="store the coordinates and number of reviews of unscraped attractions without coordinates",
+    )
+    parser.add_argument(
+        "--remaining",
+        action="store_true",
+        help="print the attractions and reviews left to be scraped per tile and exit",
+    )
+    parser.add_argument(
+        "--largest-first",
+        action="store_true",
+        help="scrape the attractions with the most reviews left first (run --locate before)",
+    )
+    parser.add_argument(
+        "--chunk-pages",
+        type=int,
+        help="split the review pages of claimed attractions into chunks of this many pages, claimed by any worker (with --worker)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="rescrape scraped attractions from their newest page until a known review is found",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="scrape only the new review pages of scraped attractions whose number of reviews grew",
+    )
+    parser.add_argument(
+        "--selenium-fallback",
+        action="store_true",
+        help="render attraction pages in Chrome if their details are missing from the page's JSON",
+    )
+    parser.add_argument(
+        "--drivers",
+        type=int,
+        default=2,
+        help="the number of reusable Chrome drivers (with --selenium-fallback)",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="keep the review pages of several attractions in flight at once",
+    )
+    parser.add_argument(
+        "--max-attractions",
+        type=int,
+        default=4,
+        help="the number of attractions scraped concurrently (with --async)",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        default=4,
+        help="the number of concurrent requests per host (with --async)",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="fetch, parse and store review pages in concurrent stages",
+    )
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_dedup_arguments(parser)
+    args = parser.parse_args()
+    start_from_args(args)
+
     conn = db.connect(**dotenv_values())
     conn_iter = db.connect(**dotenv_values())
-    r = ReviewScraper(db_conn=conn, db_iter_conn=conn_iter, attr_types="all")
-    r.do_scrape()
+    driver_pool = (
+        selenium_utils.DriverPool(size=args.drivers)
+        if args.selenium_fallback
+        else None
+    )
+    r = ReviewScraper(
+        db_conn=conn,
+        db_iter_conn=conn_iter,
+        attr_types="all",
+        driver_pool=driver_pool,
+        selenium_fallback=args.selenium_fallback,
+        incremental=args.incremental,
+        largest_first=args.largest_first,
+        cache=cache_from_args(args),
+        dedup=dedup_from_args(args, conn),
+    )
+    queue = WorkQueue(
+        conn_iter,
+        worker_id=args.worker_id,
+        lease=args.lease,
+        attr_types="all",
+        bbox=args.bbox,
+        tile_precision=args.tile_precision,
+        largest_first=args.largest_first,
+        chunk_pages=args.chunk_pages,
+    )
+    if args.remaining:
+        for tile, attractions, reviews, leased in queue.remaining():
+            print(f"{tile}: {attractions} attractions, {reviews} reviews, {leased} leased")
+    elif args.locate:
+        r.do_locate()
+    elif args.worker:
+        r.do_work(queue)
+    elif args.refresh:
+        r.do_refresh()
+    elif args.use_async:
+        asyncio.run(
+            r.do_scrape_async(
+                max_attractions=args.max_attractions, max_per_host=args.max_per_host
+            )
+        )
+    elif args.pipelined:
+        r.do_scrape_pipelined()
+    else:
+        r.do_scrape()
+    r.close()
+    if driver_pool is not None:
+        driver_pool.close()
     r.db_conn.close()
     r.db_iter_conn.close()
+    if args.metrics_file is not None:
+        METRICS.write(args.metrics_file)
 
 
 if __name__ == "__main__":
@@ -3,26 +3,149 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from selenium.common.exceptions import WebDriverException
+from contextlib import contextmanager
+from queue import Queue
 import re
 
-def get_attr_details(url):
+def make_driver():
     """
-    Opens a headless Chrome instance and parses attraction details for which web page rendering is necessary.
+    Opens a headless Chrome instance.
+
+    Returns
+    -------
+    driver : selenium.webdriver.Chrome
+        a headless Chrome driver
+    """
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    return webdriver.Chrome("./chromedriver", options=chrome_options)
+
+
+class DriverPool:
+    """
+    A pool of long-lived headless Chrome instances that are reused across attractions.
+    Drivers are started lazily, recycled after max_pages pages and replaced if they crash.
+
+    Attributes
+    ----------
+    size : int
+        the maximum number of concurrently running drivers
+    max_pages : int
+        the number of pages after which a driver is restarted
+    """
+
+    def __init__(self, size=2, max_pages=50):
+        self.size = size
+        self.max_pages = max_pages
+        self._idle = Queue()
+        self._pages = {}
+        for _ in range(size):
+            self._idle.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def driver(self):
+        """
+        Checks out a driver for the duration of the with block, waiting if all drivers are in use.
+
+        Yields
+        ------
+        driver : selenium.webdriver.Chrome
+            a headless Chrome driver
+        """
+        driver = self._idle.get()
+        if driver is None:
+            try:
+                driver = make_driver()
+            except:
+                self._idle.put(None)
+                raise
+            self._pages[driver] = 0
+
+        try:
+            yield driver
+        except WebDriverException:
+            self._discard(driver)
+            raise
+        except:
+            self._idle.put(driver)
+            raise
+
+        self._pages[driver] += 1
+        if self._pages[driver] >= self.max_pages:
+            self._discard(driver)
+        else:
+            self._idle.put(driver)
+
+    def _discard(self, driver):
+        del self._pages[driver]
+        try:
+            driver.quit()
+        except:
+            pass
+        self._idle.put(None)
+
+    def close(self):
+        """
+        Quits all idle drivers.
+        """
+        while not self._idle.empty():
+            driver = self._idle.get()
+            if driver is not None:
+                del self._pages[driver]
+                driver.quit()
+
+
+def get_attr_details(url, pool=None):
+    """
+    Parses attraction details for which web page rendering is necessary, either with a driver
+    from the passed pool or with a headless Chrome instance opened for this call only.
 
     Parameters
     ----------
     url : str
         the attraction's url
+    pool : DriverPool
+        an optional pool of drivers to be reused
     
     Returns
     -------
     attraction details : tuple
         a tuple of (coordinates, number of reviews, number of pages)
     """
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    driver = webdriver.Chrome("./chromedriver", options=chrome_options)
+    if pool is not None:
+        with pool.driver() as driver:
+            return read_attr_details(driver, url)
+
+    driver = make_driver()
+    try:
+        return read_attr_details(driver, url)
+    finally:
+        driver.quit()
+
+
+def read_attr_details(driver, url):
+    """
+    Loads the attraction page in the passed driver and parses its details.
 
+    Parameters
+    ----------
+    driver : selenium.webdriver.Chrome
+        a Chrome driver
+    url : str
+        the attraction's url
+    
+    Returns
+    -------
+    attraction details : tuple
+        a tuple of (coordinates, number of reviews, number of pages); each detail is None if it could not be read
+    """
     driver.get(url)
     try:
         img = WebDriverWait(driver, 7)\
@@ -31,7 +154,7 @@ def get_attr_details(url):
         location = re.match(r".*center=(\d{2}.\d*),(-{0,1}\d{1}.\d*)&", img)
         coords = [float(location.group(1)), float(location.group(2))]
     except:
-        coords = [None, None]
+        coords = None
 
     number_of_reviews = {}
     try:
@@ -46,9 +169,13 @@ def get_attr_details(url):
 
 
     try:
-        num_pages = int(driver.find_elements_by_xpath('.//div[@class="pageNumbers"]//a[@class="pageNum "]')[-1].text)
+        links = driver.find_elements_by_xpath('.//div[@class="pageNumbers"]//a[@class="pageNum "]')
+        # without page numbers all reviews are on one page, unless the reviews did not load at all
+        if links:
+            num_pages = int(links[-1].text)
+        else:
+            num_pages = 1 if number_of_reviews is not None else None
     except:
-        num_pages = 1
+        num_pages = None
 
-    driver.quit()
     return (coords, number_of_reviews, num_pages)
\ No newline at end of file
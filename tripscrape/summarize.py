@@ -0,0 +1,249 @@
+import argparse
+from time import perf_counter
+
+import psycopg2 as db
+from dotenv import dotenv_values
+from psycopg2.extras import execute_values
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:
+    pd = None
+
+REVIEWS_QUERY = """SELECT attr_id, rating, date, published_date FROM reviews
+    WHERE attr_id IS NOT NULL ORDER BY attr_id"""
+REVIEW_COLUMNS = ["attr_id", "rating", "date", "published_date"]
+
+# num_reviews holds the listed reviews per language (or a bare count in old rows)
+LANGUAGES_QUERY = """SELECT a.id, l.key, l.value::integer
+    FROM attractions a, json_each_text(a.num_reviews) l
+    WHERE json_typeof(a.num_reviews) = 'object' AND l.value IS NOT NULL"""
+
+RATINGS = ["rating_1", "rating_2", "rating_3", "rating_4", "rating_5"]
+
+# the summary tables of migration 006 and the columns written to them
+TABLES = {
+    "attraction_ratings": ["attr_id", "reviews", "listed_reviews", "coverage"]
+    + RATINGS
+    + ["mean_rating", "first_review", "last_review"],
+    "attraction_monthly_reviews": ["attr_id", "month", "reviews", "mean_rating"],
+    "attraction_languages": ["attr_id", "language", "listed_reviews", "share"],
+}
+
+
+def parse_dates(values):
+    """
+    Vectorized version of reviews.parse_review_date().
+
+    Parameters
+    ----------
+    values : pandas.Series
+        ISO dates (the publishedDate of the __WEB_CONTEXT__) or "Month YYYY" dates of older scrapes
+
+    Returns
+    -------
+    pandas.Series
+        the parsed dates (the first of the month for "Month YYYY" dates), NaT if the format is unknown
+    """
+    values = values.astype("string")
+    iso = pd.to_datetime(values.str.slice(0, 10), format="%Y-%m-%d", errors="coerce")
+    return iso.fillna(pd.to_datetime(values, format="%B %Y", errors="coerce"))
+
+
+def records(frame):
+    """
+    Converts a DataFrame into tuples of Python values, with None for missing values, for psycopg2.
+    """
+    columns = [
+        frame[c].astype(object).where(frame[c].notna(), None).tolist()
+        for c in frame.columns
+    ]
+    return list(zip(*columns))
+
+
+class Summarizer:
+    """
+    Rebuilds the per-attraction summary tables of migration 006 from the reviews.
+
+    The reviews are streamed in chunks ordered by attraction with a server-side (named) cursor
+    and every chunk is summarized column-wise with numpy and pandas: publication dates are taken
+    from published_date or parsed from the raw date string, ratings outside 1-5 are dropped, and
+    the rating histograms, publication ranges and monthly counts of the attractions completed by
+    the chunk are written. The reviews of the chunk's last attraction are carried over to the
+    next chunk, so memory use is bounded by the chunk size and the largest attraction.
+
+    All tables are replaced in one transaction, so readers see the previous summaries until the
+    rebuild is committed.
+
+    Attributes
+    ----------
+    db_conn : psycopg2.connection()
+        a psycopg2 connection to PostgreSQL
+    chunk_size : int
+        the number of reviews per chunk (and per database round trip)
+    """
+
+    def __init__(self, db_conn, chunk_size=200_000):
+        if pd is None:
+            raise RuntimeError("numpy and pandas are required to summarize reviews")
+        self.db_conn = db_conn
+        self.chunk_size = chunk_size
+
+    def read_languages(self):
+        """
+        Reads the listed reviews per language of all attractions.
+
+        Returns
+        -------
+        pandas.DataFrame
+            the attr_id, language, listed_reviews and share (of the attraction's listed reviews) columns
+        """
+        with self.db_conn.cursor() as cur:
+            cur.execute(LANGUAGES_QUERY)
+            languages = pd.DataFrame(
+                cur.fetchall(), columns=["attr_id", "language", "listed_reviews"]
+            )
+        totals = languages.groupby("attr_id")["listed_reviews"].transform("sum")
+        languages["share"] = languages["listed_reviews"] / totals.where(totals > 0)
+        return languages
+
+    def summarize_chunk(self, reviews, listed):
+        """
+        Summarizes the reviews of complete attractions.
+
+        Parameters
+        ----------
+        reviews : pandas.DataFrame
+            the REVIEW_COLUMNS of all reviews of some attractions
+        listed : pandas.Series
+            the number of listed reviews (over all languages) by attraction id
+
+        Returns
+        -------
+        tuple
+            the attraction_ratings and attraction_monthly_reviews rows as DataFrames
+        """
+        published = pd.to_datetime(reviews["published_date"])
+        missing = published.isna()
+        if missing.any():
+            published[missing] = parse_dates(reviews.loc[missing, "date"])
+        rating = pd.to_numeric(reviews["rating"], errors="coerce")
+        rating = rating.where(rating.between(1, 5))
+
+        codes, attr_ids = pd.factorize(reviews["attr_id"], sort=True)
+        n = len(attr_ids)
+        valid = rating.notna().to_numpy()
+        bins = codes[valid] * 5 + rating[valid].to_numpy(dtype=np.int64) - 1
+        histogram = np.bincount(bins, minlength=n * 5).reshape(n, 5)
+        rated = histogram.sum(axis=1)
+        dates = published.groupby(codes).agg(["min", "max"])
+
+        ratings = pd.DataFrame(histogram, columns=RATINGS)
+        ratings.insert(0, "attr_id", attr_ids)
+        ratings.insert(1, "reviews", np.bincount(codes, minlength=n))
+        listed = listed.reindex(attr_ids).astype("Int64").reset_index(drop=True)
+        ratings.insert(2, "listed_reviews", listed)
+        ratings.insert(3, "coverage", ratings["reviews"] / listed.where(listed > 0))
+        ratings["mean_rating"] = np.divide(
+            histogram @ np.arange(1, 6),
+            rated,
+            out=np.full(n, np.nan),
+            where=rated > 0,
+        )
+        ratings["first_review"] = dates["min"].dt.date.to_numpy()
+        ratings["last_review"] = dates["max"].dt.date.to_numpy()
+
+        frame = pd.DataFrame(
+            {
+                "attr_id": reviews["attr_id"],
+                "month": published.dt.to_period("M").dt.to_timestamp(),
+                "rating": rating,
+            }
+        ).dropna(subset=["month"])
+        monthly = (
+            frame.groupby(["attr_id", "month"])
+            .agg(reviews=("rating", "size"), mean_rating=("rating", "mean"))
+            .reset_index()
+        )
+        monthly["month"] = monthly["month"].dt.date
+        return ratings, monthly
+
+    def write(self, cur, table, frame):
+        columns = TABLES[table]
+        execute_values(
+            cur,
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s;",
+            records(frame[columns]),
+            page_size=1000,
+        )
+
+    def summarize(self):
+        """
+        Rebuilds all summary tables.
+
+        Returns
+        -------
+        int
+            the number of summarized reviews
+        """
+        start = perf_counter()
+        languages = self.read_languages()
+        listed = languages.groupby("attr_id")["listed_reviews"].sum()
+        count = 0
+        attractions = 0
+        with self.db_conn.cursor() as cur:
+            for table in TABLES:
+                cur.execute(f"DELETE FROM {table};")
+            self.write(cur, "attraction_languages", languages)
+
+            carry = None
+            with self.db_conn.cursor(name="summarize_reviews") as reviews_cur:
+                reviews_cur.itersize = self.chunk_size
+                reviews_cur.execute(REVIEWS_QUERY)
+                while True:
+                    rows = reviews_cur.fetchmany(self.chunk_size)
+                    chunk = pd.DataFrame(rows, columns=REVIEW_COLUMNS)
+                    if carry is not None:
+                        chunk = pd.concat([carry, chunk], ignore_index=True)
+                    if rows:
+                        # the last attraction may continue in the next chunk
+                        last = chunk["attr_id"] == chunk["attr_id"].iloc[-1]
+                        carry = chunk[last]
+                        chunk = chunk[~last].reset_index(drop=True)
+                    if len(chunk):
+                        ratings, monthly = self.summarize_chunk(chunk, listed)
+                        self.write(cur, "attraction_ratings", ratings)
+                        self.write(cur, "attraction_monthly_reviews", monthly)
+                        count += len(chunk)
+                        attractions += len(ratings)
+                    if not rows:
+                        break
+        self.db_conn.commit()
+        print(
+            "Summarized {} reviews of {} attractions ({} languages) in {:.1f} s".format(
+                count, attractions, len(languages), perf_counter() - start
+            )
+        )
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the per-attraction review summary tables"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=200_000,
+        help="the number of reviews summarized at a time",
+    )
+    args = parser.parse_args()
+
+    conn = db.connect(**dotenv_values())
+    Summarizer(conn, chunk_size=args.chunk_size).summarize()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
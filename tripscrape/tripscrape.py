@@ -1,9 +1,52 @@
 import re
+from functools import partial
 from time import sleep
 
 import psycopg2 as db
 from bs4 import BeautifulSoup as bs
-from requests import get
+from urllib.parse import urlsplit
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from cache import CacheMiss
+from metrics import METRICS
+from ratelimit import CircuitOpenError, RateControl, RetriesExhausted, retry_after
+from writer import BatchWriter
+
+try:
+    import lxml
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# the longest wait between two checks of an open circuit, so that requests resume soon
+# after the half-open trial request of another thread succeeded
+CIRCUIT_POLL = 5.0
+
+
+def make_session(pool_size=10):
+    """
+    Creates a requests session with a keep-alive connection pool.
+
+    Parameters
+    ----------
+    pool_size : int
+        the number of connections kept alive per host
+
+    Returns
+    -------
+    requests.Session
+        a session negotiating gzip (and brotli, if installed) compression
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
 
 
 class Scraper:
@@ -18,15 +61,197 @@ class Scraper:
         a TripAdvisor place ID
     base_url : string
         The base url to be formatted
+    pool_size : int
+        the number of connections kept alive per host
+    timeout : tuple
+        the (connect, read) timeout of every request in seconds
+    batch_size : int
+        the number of buffered writes that triggers a database flush
+    flush_interval : float
+        the number of seconds after which buffered writes are flushed
+    rate_control : ratelimit.RateControl
+        the rate limiter, backoff and circuit breaker of all requests (may be shared between scrapers)
+    cache : cache.ResponseCache
+        an optional on-disk cache of the responses
+    html_parser : str
+        the BeautifulSoup tree builder (defaults to "lxml" if installed, "html.parser" otherwise)
     """
 
+    html_parser = HTML_PARSER
+
     def __init__(
-        self, db_conn=None, place_id=186338, base_url="https://www.tripadvisor.com"
+        self,
+        db_conn=None,
+        place_id=186338,
+        base_url="https://www.tripadvisor.com",
+        pool_size=10,
+        timeout=(10, 30),
+        batch_size=500,
+        flush_interval=5.0,
+        rate_control=None,
+        cache=None,
     ):
         self.db_conn = db_conn
         self.db_cur = db_conn.cursor()
         self.base_url = base_url
         self.place_id = place_id
+        self.session = make_session(pool_size)
+        self.timeout = timeout
+        self.writer = BatchWriter(db_conn, batch_size, flush_interval)
+        self.rate_control = rate_control or RateControl()
+        self.cache = cache
+
+    def fetch(self, url):
+        """
+        Retrieves the passed url from the cache or through the scraper's pooled session, paced by its rate control.
+        Connection errors, 429 and 5xx responses are retried with backoff, successful responses are cached.
+        Expired cache entries are revalidated with a conditional request (If-None-Match / If-Modified-Since).
+        While the circuit of the host is open, the request waits for it to close.
+
+        Parameters
+        ----------
+        url : str
+            the url to be retrieved
+
+        Returns
+        -------
+        requests.Response
+            the response of the request, with an `unchanged` attribute set to True if the server
+            answered 304 (the cached body is returned) or sent the same body as the cached one,
+            and that body was marked as stored (see mark_stored())
+
+        Raises
+        ------
+        ratelimit.RetriesExhausted
+            if the request failed max_attempts times
+        cache.CacheMiss
+            if the url is not cached and the cache is in cache-only mode
+        """
+        with METRICS.time("fetch_seconds"):
+            return self._fetch(url)
+
+    def _acquire(self, host):
+        """
+        Reserves the next request slot for a host, waiting while its circuit is open.
+
+        Returns
+        -------
+        float
+            the number of seconds to wait before sending the request
+        """
+        while True:
+            try:
+                return self.rate_control.acquire(host)
+            except CircuitOpenError as e:
+                METRICS.count("circuit_waits")
+                METRICS.log(
+                    "circuit open",
+                    f"Requests to {host} suspended for {e.wait:.0f} s",
+                )
+                sleep(min(e.wait, CIRCUIT_POLL))
+
+    def _fetch(self, url):
+        if self.cache is not None:
+            response = self.cache.get(url)
+            if response is not None:
+                METRICS.count("cache_hits")
+                return response
+            elif self.cache.cache_only:
+                raise CacheMiss(url)
+            headers = self.cache.validators(url)
+        else:
+            headers = {}
+
+        host = urlsplit(url).netloc
+        for attempt in range(self.rate_control.max_attempts):
+            sleep(self._acquire(host))
+            try:
+                with METRICS.time("http_request_seconds"):
+                    response = self.session.get(
+                        url, timeout=self.timeout, headers=headers
+                    )
+            except RequestException as e:
+                METRICS.count("request_errors")
+                METRICS.log("request error", f"Request to {url} failed: {e}")
+                delay = self.rate_control.failure(host, attempt)
+            else:
+                METRICS.count("responses", str(response.status_code))
+                if response.status_code == 429 or response.status_code >= 500:
+                    METRICS.log(
+                        "request throttled",
+                        f"Request to {url} returned {response.status_code}",
+                    )
+                    delay = self.rate_control.failure(
+                        host, attempt, throttled=True, retry_after=retry_after(response)
+                    )
+                else:
+                    self.rate_control.success(host)
+                    response.unchanged = False
+                    if response.status_code == 304 and self.cache is not None:
+                        cached = self.cache.get(url, stale=True)
+                        if cached is None:
+                            # evicted since the validators were read, so ask again without them
+                            headers = {}
+                            continue
+                        self.cache.touch(url)
+                        cached.unchanged = self.cache.stored(url)
+                        if cached.unchanged:
+                            METRICS.count("unchanged_pages", "304")
+                        return cached
+                    if self.cache is not None and response.status_code == 200:
+                        response.unchanged = self.cache.put(url, response)
+                        if response.unchanged:
+                            METRICS.count("unchanged_pages", "hash")
+                    return response
+            if attempt + 1 < self.rate_control.max_attempts:
+                sleep(delay)
+        raise RetriesExhausted(url)
+
+    def mark_stored(self, url):
+        """
+        Marks the cached response of a url as stored once the buffered writes are committed,
+        so that the page is skipped when it is fetched unchanged again.
+
+        Parameters
+        ----------
+        url : str
+            the requested url of the page
+        """
+        if self.cache is not None and not self.cache.cache_only:
+            self.writer.after_flush(partial(self.cache.mark_stored, url))
+
+    def discard(self, url):
+        """
+        Removes the cached response of a url whose page could not be parsed, so that a retry
+        fetches (and caches) it again instead of parsing the same broken page.
+        Cache-only caches are left as they are, since their pages cannot be fetched again.
+
+        Parameters
+        ----------
+        url : str
+            the url of the page
+        """
+        if self.cache is not None and not self.cache.cache_only:
+            self.cache.delete(url)
+            METRICS.count("discarded_pages")
+
+    def make_soup(self, markup, parse_only=None):
+        """
+        Parses a web page with the scraper's parser backend.
+
+        Parameters
+        ----------
+        markup : bytes
+            the web page to be parsed
+        parse_only : SoupStrainer
+            an optional SoupStrainer restricting the tree to the matching elements
+
+        Returns
+        -------
+        BeautifulSoup
+            the parsed web page
+        """
+        return bs(markup, self.html_parser, parse_only=parse_only)
 
     def get_num_pages(self, soup, search_type):
         """
@@ -42,7 +267,7 @@ class Scraper:
         Returns
         -------
         int
-            number of pages found
+            number of pages found (1 for search results without pagination)
         """
         if search_type == "reviews":
             num_string = soup.find("span", {"class": "mxlinKbW"}).get_text()
@@ -50,15 +275,15 @@ class Scraper:
             return num_pages
 
         elif search_type == "attractions":
-            num_string = (
-                soup.find("div", {"class": "pageNumbers"})
-                .findChildren(recursive=True)[-1]
-                .get_text()
-            )
+            pagination = soup.find("div", {"class": "pageNumbers"})
+            if pagination is None:
+                # places with a single results page have no page numbers
+                return 1
+            num_string = pagination.findChildren(recursive=True)[-1].get_text()
             num_pages = int(num_string)
             return num_pages
 
-    def generate_page_links(self, amount, search_type, url=None):
+    def generate_page_links(self, amount, search_type, url=None, place_id=None):
         """
         Generates links for every page of the search results or reviews.
 
@@ -70,6 +295,8 @@ class Scraper:
             number of pages to be generated
         search_type: str
             Whether the webpage displays reviews or attraction search results (accepts "reviews" or "attractions")
+        place_id : int
+            the TripAdvisor place ID of the search results (defaults to the scraper's place_id)
 
         Returns
         -------
@@ -79,7 +306,8 @@ class Scraper:
 
         if search_type == "attractions":
             pages = [""] + ["oa{}".format(i * 30) for i in range(amount)][1:]
-            return [self.base_url.format(self.place_id, i) for i in pages]
+            place_id = self.place_id if place_id is None else place_id
+            return [self.base_url.format(place_id, i) for i in pages]
 
         elif search_type == "reviews":
             url = url.replace("-Reviews", "-Reviews-{}")
@@ -88,7 +316,7 @@ class Scraper:
 
     def update_record(self, querystring):
         """
-        Executes the passed querystring
+        Buffers the passed querystring, it is executed after all buffered rows on the next flush
 
         Parameters
         ----------
@@ -96,10 +324,40 @@ class Scraper:
         querystring : str
             A querystring to be executed in PostgreSQL
         """
-        self.db_cur.execute(querystring)
-        self.db_conn.commit()
+        with METRICS.time("update_record_seconds"):
+            self.writer.execute(querystring)
+        return
+
+    def insert_row(self, statement, row):
+        """
+        Buffers a row to be inserted with the next flush
+
+        Parameters
+        ----------
+
+        statement : str
+            an INSERT statement with a single VALUES %s placeholder
+        row : tuple
+            the row to be inserted
+        """
+        self.writer.add(statement, row)
         return
 
+    def flush(self):
+        """
+        Writes and commits all buffered rows and querystrings
+        """
+        self.writer.flush()
+
+    def close(self):
+        """
+        Flushes all buffered writes and closes the HTTP session and the cache
+        """
+        self.flush()
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
 
 class Attraction:
     """
@@ -112,7 +370,7 @@ class Attraction:
     name : str
         the attraction's full, human readable, name
     url : str
-        the relative URL to the attraction's TripAdvisor page
+        the relative URL to the attraction's TripAdvisor page (also sets the ID)
     attr_type : str
         the attraction's type according to TripAdvisor's classification system
     location : list
@@ -121,31 +379,17 @@ class Attraction:
         the number of reviews in the three most frequent review languages
     """
 
+    __slots__ = ("ID", "name", "_url", "attr_type", "location", "num_reviews")
+
     def __init__(
         self, ID=None, name=None, url=None, attr_type=None, location=None, num_reviews=0
     ):
-        self._ID = ID
-        self._name = name
+        self.ID = ID
+        self.name = name
         self._url = url
-        self._attr_type = attr_type
-        self._location = location
-        self._num_reviews = num_reviews
-
-    @property
-    def ID(self):
-        return self._ID
-
-    @ID.setter
-    def ID(self, value):
-        self._ID = value
-
-    @property
-    def name(self):
-        return self._name
-
-    @name.setter
-    def name(self, value):
-        self._name = value
+        self.attr_type = attr_type
+        self.location = location
+        self.num_reviews = num_reviews
 
     @property
     def url(self):
@@ -154,33 +398,15 @@ class Attraction:
     @url.setter
     def url(self, value):
         self._url = value
-        self._ID = int(
+        self.ID = int(
             re.match(r"/Attraction_Review-g\d*-d(\d*)-", value).group(1)
         )  # also sets value for ID using regex
 
-    @property
-    def attr_type(self):
-        return self._attr_type
-
-    @attr_type.setter
-    def attr_type(self, value):
-        self._attr_type = value
-
-    @property
-    def location(self):
-        return self._location
-
-    @location.setter
-    def location(self, value):
-        self._location = value
-
-    @property
-    def num_reviews(self):
-        return self._num_reviews
-
-    @num_reviews.setter
-    def num_reviews(self, value):
-        self._num_reviews = value
+    def as_row(self):
+        """
+        Returns the (ID, name, url, attr_type) row of the attraction in the column order of the attractions table.
+        """
+        return (self.ID, self.name, self._url, self.attr_type)
 
 
 class Review:
@@ -203,8 +429,21 @@ class Review:
         TripAdvisor attraction id of the reviewed attraction
     user_profile : str
         the relative URL to the user profile
+    published_date : datetime.date
+        the date of the review parsed from date, or None if its format is unknown
     """
 
+    __slots__ = (
+        "ID",
+        "title",
+        "rating",
+        "date",
+        "full",
+        "attr_ID",
+        "user_profile",
+        "published_date",
+    )
+
     def __init__(
         self,
         ID=None,
@@ -214,70 +453,35 @@ class Review:
         full=None,
         attr_ID=None,
         user_profile=None,
+        published_date=None,
     ):
-        self._ID = ID
-        self._title = title
-        self._rating = rating
-        self._date = date
-        self._full = full
-        self._attr_ID = attr_ID
-        self._user_profile = user_profile
-
-    @property
-    def ID(self):
-        return self._ID
-
-    @ID.setter
-    def ID(self, value):
-        self._ID = value
-
-    @property
-    def title(self):
-        return self._title
-
-    @title.setter
-    def title(self, value):
-        self._title = value
-
-    @property
-    def rating(self):
-        return self._rating
-
-    @rating.setter
-    def rating(self, value):
-        self._rating = value
-
-    @property
-    def date(self):
-        return self._date
-
-    @date.setter
-    def date(self, value):
-        self._date = value
-
-    @property
-    def full(self):
-        return self._full
-
-    @full.setter
-    def full(self, value):
-        self._full = value
-
-    @property
-    def attr_ID(self):
-        return self._attr_ID
-
-    @attr_ID.setter
-    def attr_ID(self, value):
-        self._attr_ID = value
-
-    @property
-    def user_profile(self):
-        return self._user_profile
-
-    @user_profile.setter
-    def user_profile(self, value):
-        self._user_profile = value
+        self.ID = ID
+        self.title = title
+        self.rating = rating
+        self.date = date
+        self.full = full
+        self.attr_ID = attr_ID
+        self.user_profile = user_profile
+        self.published_date = published_date
+
+    def as_row(self):
+        """
+        Returns the review as a tuple in the column order of the reviews table.
+        """
+        return (
+            self.ID,
+            self.title,
+            self.rating,
+            self.date,
+            self.full,
+            self.attr_ID,
+            self.user_profile,
+            self.published_date,
+        )
+
+    def __reduce__(self):
+        # pickled as constructor arguments, which is smaller than the slot state
+        return (Review, self.as_row())
 
 
 class User:
@@ -296,42 +500,21 @@ class User:
         the number of helpful votes a user has received on TripAdvisor
     """
 
+    __slots__ = ("profile", "location", "contributions", "helpful_votes")
+
     def __init__(
         self, profile=None, location=None, contributions=None, helpful_votes=None
     ):
-        self._profile = profile
-        self._location = location
-        self._contributions = contributions
-        self._helpful_votes = helpful_votes
-
-    @property
-    def profile(self):
-        return self._profile
-
-    @profile.setter
-    def profile(self, value):
-        self._profile = value
-
-    @property
-    def location(self):
-        return self._location
+        self.profile = profile
+        self.location = location
+        self.contributions = contributions
+        self.helpful_votes = helpful_votes
 
-    @location.setter
-    def location(self, value):
-        self._location = value
-
-    @property
-    def contributions(self):
-        return self._contributions
-
-    @contributions.setter
-    def contributions(self, value):
-        self._contributions = value
-
-    @property
-    def helpful_votes(self):
-        return self._helpful_votes
+    def as_row(self):
+        """
+        Returns the user as a tuple in the column order of the users table.
+        """
+        return (self.profile, self.location, self.contributions, self.helpful_votes)
 
-    @helpful_votes.setter
-    def helpful_votes(self, value):
-        self._helpful_votes = value
+    def __reduce__(self):
+        return (User, self.as_row())
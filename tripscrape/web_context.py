@@ -0,0 +1,133 @@
+from math import ceil
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+MARKER = "window.__WEB_CONTEXT__="
+
+
+def parse(text):
+    """
+    Extracts and parses the window.__WEB_CONTEXT__ object embedded in a TripAdvisor page.
+
+    Parameters
+    ----------
+    text : str
+        the html of a TripAdvisor page
+
+    Returns
+    -------
+    dict
+        the parsed __WEB_CONTEXT__ object
+
+    Raises
+    ------
+    ValueError
+        if the page contains no __WEB_CONTEXT__ object
+    """
+    start = text.find(MARKER)
+    end = text.find("};", start)
+    if start == -1 or end == -1:
+        raise ValueError("No __WEB_CONTEXT__ found")
+    data = text[start + len(MARKER) : end + 1]
+    # the only unquoted key of the object
+    return loads(data.replace("pageManifest", '"pageManifest"', 1))
+
+
+def find_reviews(data):
+    """
+    Finds all review lists in a parsed __WEB_CONTEXT__ object in a single pass.
+
+    Parameters
+    ----------
+    data : dict
+        the parsed __WEB_CONTEXT__ object
+
+    Returns
+    -------
+    list
+        the values of all "reviews" keys (not searched any further)
+    """
+    review_lists = []
+    stack = [data]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, dict):
+            for k, child in v.items():
+                if k == "reviews":
+                    review_lists.append(child)
+                elif isinstance(child, (dict, list)):
+                    stack.append(child)
+        elif isinstance(v, list):
+            stack.extend(c for c in v if isinstance(c, (dict, list)))
+    return review_lists
+
+
+def iter_dicts(val):
+    """
+    Iterates over all dictionaries nested in a parsed __WEB_CONTEXT__ object.
+
+    Parameters
+    ----------
+    val : dict or list
+        a parsed __WEB_CONTEXT__ object or a part of it
+
+    Yields
+    ------
+    dict
+        every nested dictionary, including val itself
+    """
+    stack = [val]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, dict):
+            yield v
+            stack.extend(v.values())
+        elif isinstance(v, list):
+            stack.extend(v)
+
+
+def get_attr_details(data, attr_ID=None, reviews_per_page=5):
+    """
+    Reads an attraction's details from the __WEB_CONTEXT__ of its first review page.
+
+    Parameters
+    ----------
+    data : dict
+        the parsed __WEB_CONTEXT__ object
+    attr_ID : int
+        the TripAdvisor attraction id, used to pick the attraction's own location
+        among those of nearby attractions (the first location found is used if None)
+    reviews_per_page : int
+        the number of reviews shown per review page
+
+    Returns
+    -------
+    attraction details : tuple
+        a tuple of (coordinates, number of reviews, number of pages) like
+        selenium_utils.get_attr_details(), except that the number of reviews is keyed
+        by language code; each detail is None if it could not be found
+    """
+    coords = None
+    number_of_reviews = None
+    total = None
+
+    for d in iter_dicts(data):
+        if (
+            coords is None
+            and isinstance(d.get("latitude"), (int, float))
+            and isinstance(d.get("longitude"), (int, float))
+            and (attr_ID is None or d.get("locationId") == attr_ID)
+        ):
+            coords = [float(d["latitude"]), float(d["longitude"])]
+        if number_of_reviews is None and isinstance(d.get("languageCounts"), dict):
+            number_of_reviews = {
+                k: int(v) for k, v in d["languageCounts"].items() if v is not None
+            }
+        if total is None and "reviews" in d and isinstance(d.get("totalCount"), int):
+            total = d["totalCount"]
+
+    num_pages = None if total is None else max(1, ceil(total / reviews_per_page))
+    return (coords, number_of_reviews, num_pages)
@@ -0,0 +1,350 @@
+import os
+import socket
+from time import monotonic
+
+from psycopg2.extras import execute_values
+
+# the cost of an attraction: its reviews (from the stored num_reviews) not yet covered by
+# its checkpoint; unknown (NULL) until its details are read
+REMAINING_REVIEWS = "total_reviews(num_reviews) - coalesce(last_offset + 5, 0)"
+
+
+class LeaseLost(Exception):
+    """
+    Raised by a worker that lost the lease on its attraction or chunk to another worker.
+    """
+
+
+class WorkQueue:
+    """
+    A queue of unscraped attractions backed by the attractions table.
+    Workers claim attractions with a lease that has to be renewed with heartbeat(),
+    attractions whose lease expired (e.g. because their worker crashed) are claimed again.
+
+    Claims can be restricted to a bounding box, and with a tile precision every worker claims
+    the attractions of one geohash tile until it is done, then moves on to the tile with the
+    fewest other workers and the most reviews left. Attractions without coordinates (see
+    ReviewScraper.do_locate()) are claimed once no tile is left, unless a bounding box is set.
+
+    Largest-first claims take the attractions with the most reviews left first, so that the
+    largest attractions do not start last and hold up the end of the run.
+
+    With a chunk size, a claimed attraction's review pages are split into chunks (see split())
+    that any worker claims with claim_chunk(); attractions with open chunks are not claimed again.
+
+    Attributes
+    ----------
+    db_conn : psycopg2.connection()
+        a psycopg2 connection to PostgreSQL, used for the queue only
+    worker_id : str
+        the name of the worker holding the leases (defaults to host:pid)
+    lease : int
+        the number of seconds a claim is valid without a heartbeat
+    attr_types : tuple
+        the types of attractions to be claimed, or "all"
+    bbox : tuple
+        an optional (min_lon, min_lat, max_lon, max_lat) bounding box of the attractions to be claimed
+    tile_precision : int
+        the number of geohash characters of a tile (e.g. 5 for about 5 x 5 km), or None to claim
+        attractions regardless of their location
+    largest_first : bool
+        whether to claim the attractions with the most reviews left first instead of the newest ones
+        (attractions without details are claimed last)
+    chunk_pages : int
+        the number of review pages per chunk, or None to scrape attractions as a whole
+    tile : str
+        the geohash prefix of the tile the worker currently claims from
+    """
+
+    def __init__(
+        self,
+        db_conn,
+        worker_id=None,
+        lease=300,
+        attr_types="all",
+        bbox=None,
+        tile_precision=None,
+        largest_first=False,
+        chunk_pages=None,
+    ):
+        self.db_conn = db_conn
+        self.db_cur = db_conn.cursor()
+        self.worker_id = worker_id or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.lease = lease
+        self.attr_types = attr_types
+        self.bbox = bbox
+        self.tile_precision = tile_precision
+        self.largest_first = largest_first
+        self.chunk_pages = chunk_pages
+        self.tile = None
+        self._last_heartbeat = {}
+
+    def filters(self):
+        """
+        Returns the WHERE conditions of the attraction types and the bounding box.
+
+        Returns
+        -------
+        tuple
+            a tuple of (conditions, query parameters)
+        """
+        conditions = []
+        params = []
+        if self.attr_types != "all":
+            conditions.append("attr_type IN %s")
+            if isinstance(self.attr_types, str):
+                params.append((self.attr_types,))
+            else:
+                params.append(tuple(self.attr_types))
+        if self.bbox is not None:
+            conditions.append("geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)")
+            params.extend(self.bbox)
+        return conditions, params
+
+    def _unsplit(self):
+        # the filters of attractions to be claimed, without those split into open chunks
+        conditions, params = self.filters()
+        if self.chunk_pages is not None:
+            conditions.append(
+                """NOT EXISTS (SELECT 1 FROM attraction_chunks c
+                WHERE c.attr_id = attractions.id AND NOT c.done)"""
+            )
+        return conditions, params
+
+    def claim(self):
+        """
+        Atomically claims the next unscraped attraction that is not leased by another worker
+        (within the current tile, if tiles are used).
+
+        Returns
+        -------
+        tuple
+            an (id, url, last_offset) row of the attractions table, or None if the queue is empty
+        """
+        while True:
+            if self.tile_precision is not None and self.tile is None:
+                self.tile = self.next_tile()
+                if self.tile is not None:
+                    print(f"Claiming from tile {self.tile}")
+            row = self._claim(self.tile)
+            if row is not None or self.tile is None:
+                return row
+            # the tile is done (or claimed by other workers)
+            self.tile = None
+
+    def _claim(self, tile):
+        query_template = """UPDATE attractions SET lease_owner = %s, lease_expires = now() + %s * interval '1 second'
+            WHERE id = (
+                SELECT id FROM attractions
+                WHERE scraped = False AND (lease_expires IS NULL OR lease_expires < now()){}
+                ORDER BY {}"id" DESC LIMIT 1 FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, url, last_offset;"""
+        conditions, params = self._unsplit()
+        if tile is not None:
+            conditions.append("geohash LIKE %s")
+            params.append(tile + "%")
+        query_template = query_template.format(
+            "".join(" AND " + c for c in conditions),
+            f"{REMAINING_REVIEWS} DESC NULLS LAST, " if self.largest_first else "",
+        )
+
+        self.db_cur.execute(query_template, [self.worker_id, self.lease] + params)
+        row = self.db_cur.fetchone()
+        self.db_conn.commit()
+
+        if row is not None:
+            self._last_heartbeat[row[0]] = monotonic()
+        return row
+
+    def next_tile(self):
+        """
+        Picks the tile with claimable attractions that the fewest workers hold leases in,
+        and of those the one with the most reviews left.
+
+        Returns
+        -------
+        str
+            the geohash prefix of the tile, or None if no located attraction is left to be claimed
+        """
+        conditions, params = self._unsplit()
+        self.db_cur.execute(
+            """SELECT left(geohash, %s) FROM attractions
+            WHERE scraped = False AND geohash IS NOT NULL{}
+            GROUP BY 1
+            HAVING count(*) FILTER (WHERE lease_expires IS NULL OR lease_expires < now()) > 0
+            ORDER BY count(*) FILTER (WHERE lease_expires >= now()),
+                sum(total_reviews(num_reviews)) DESC NULLS LAST
+            LIMIT 1;""".format(
+                "".join(" AND " + c for c in conditions)
+            ),
+            [self.tile_precision] + params,
+        )
+        row = self.db_cur.fetchone()
+        self.db_conn.commit()
+        return None if row is None else row[0]
+
+    def remaining(self):
+        """
+        Counts the attractions and reviews left to be scraped per tile, within the bounding box if set.
+
+        Returns
+        -------
+        list
+            (tile, attractions, reviews, leased attractions) rows, most reviews first; attractions
+            without coordinates are counted in the row of tile None
+        """
+        conditions, params = self.filters()
+        self.db_cur.execute(
+            """SELECT left(geohash, %s), count(*), sum(total_reviews(num_reviews)),
+                count(*) FILTER (WHERE lease_expires >= now())
+            FROM attractions WHERE scraped = False{}
+            GROUP BY 1 ORDER BY 3 DESC NULLS LAST;""".format(
+                "".join(" AND " + c for c in conditions)
+            ),
+            [self.tile_precision or 5] + params,
+        )
+        rows = self.db_cur.fetchall()
+        self.db_conn.commit()
+        return rows
+
+    def split(self, attr_ID, first_page, end_page):
+        """
+        Splits the remaining review pages of a claimed attraction into chunks of chunk_pages pages
+        and releases the attraction, in one transaction. Chunks of a previous split are replaced.
+        Nothing is changed if the attraction's lease was lost, e.g. while its details were read.
+
+        Parameters
+        ----------
+        attr_ID : int
+            the id of a claimed attraction
+        first_page : int
+            the index of the first review page to be scraped
+        end_page : int
+            the number of review pages of the attraction
+
+        Returns
+        -------
+        int
+            the number of chunks
+
+        Raises
+        ------
+        LeaseLost
+            if the worker no longer holds the attraction's lease
+        """
+        # releasing first locks the attraction row, so it cannot be claimed again until the commit
+        self.db_cur.execute(
+            "UPDATE attractions SET lease_owner = NULL, lease_expires = NULL WHERE id = %s AND lease_owner = %s;",
+            (attr_ID, self.worker_id),
+        )
+        if self.db_cur.rowcount != 1:
+            self.db_conn.rollback()
+            print(f"Lost lease on attraction {attr_ID}")
+            raise LeaseLost(attr_ID)
+
+        chunks = [
+            (attr_ID, page, min(page + self.chunk_pages, end_page), page)
+            for page in range(first_page, end_page, self.chunk_pages)
+        ]
+        self.db_cur.execute(
+            "DELETE FROM attraction_chunks WHERE attr_id = %s;", (attr_ID,)
+        )
+        execute_values(
+            self.db_cur,
+            "INSERT INTO attraction_chunks (attr_id, first_page, end_page, next_page) VALUES %s;",
+            chunks,
+        )
+        self.db_conn.commit()
+        self._last_heartbeat.pop(attr_ID, None)
+        return len(chunks)
+
+    def claim_chunk(self):
+        """
+        Atomically claims the next open chunk that is not leased by another worker,
+        those of the earliest split attractions first.
+
+        Returns
+        -------
+        tuple
+            an (attr_id, url, first_page, end_page, next_page) row, or None if no chunk is open
+        """
+        query_template = """UPDATE attraction_chunks SET lease_owner = %s, lease_expires = now() + %s * interval '1 second'
+            FROM attractions
+            WHERE attractions.id = attraction_chunks.attr_id
+            AND (attraction_chunks.attr_id, attraction_chunks.first_page) = (
+                SELECT c.attr_id, c.first_page FROM attraction_chunks c
+                JOIN attractions ON attractions.id = c.attr_id
+                WHERE NOT c.done AND (c.lease_expires IS NULL OR c.lease_expires < now()){}
+                ORDER BY c.created_at, c.first_page LIMIT 1 FOR UPDATE OF c SKIP LOCKED
+            )
+            RETURNING attraction_chunks.attr_id, attractions.url, attraction_chunks.first_page,
+                attraction_chunks.end_page, attraction_chunks.next_page;"""
+        conditions, params = self.filters()
+        query_template = query_template.format(
+            "".join(" AND " + c for c in conditions)
+        )
+
+        self.db_cur.execute(query_template, [self.worker_id, self.lease] + params)
+        row = self.db_cur.fetchone()
+        self.db_conn.commit()
+
+        if row is not None:
+            self._last_heartbeat[(row[0], row[2])] = monotonic()
+        return row
+
+    def heartbeat(self, attr_ID, first_page=None):
+        """
+        Renews the lease on a claimed attraction or chunk, at most three times per lease period.
+
+        Parameters
+        ----------
+        attr_ID : int
+            the id of a claimed attraction, or of the attraction of a claimed chunk
+        first_page : int
+            the first page of a claimed chunk, or None for the attraction itself
+
+        Returns
+        -------
+        bool
+            False if the lease was lost to another worker
+        """
+        key = attr_ID if first_page is None else (attr_ID, first_page)
+        if monotonic() - self._last_heartbeat.get(key, 0) < self.lease / 3:
+            return True
+
+        if first_page is None:
+            self.db_cur.execute(
+                "UPDATE attractions SET lease_expires = now() + %s * interval '1 second' WHERE id = %s AND lease_owner = %s;",
+                (self.lease, attr_ID, self.worker_id),
+            )
+        else:
+            self.db_cur.execute(
+                "UPDATE attraction_chunks SET lease_expires = now() + %s * interval '1 second' WHERE attr_id = %s AND first_page = %s AND lease_owner = %s;",
+                (self.lease, attr_ID, first_page, self.worker_id),
+            )
+        renewed = self.db_cur.rowcount == 1
+        self.db_conn.commit()
+        self._last_heartbeat[key] = monotonic()
+
+        if not renewed and first_page is None:
+            print(f"Lost lease on attraction {attr_ID}")
+        elif not renewed:
+            print(f"Lost lease on chunk {first_page} of attraction {attr_ID}")
+        return renewed
+
+    def release(self, attr_ID):
+        """
+        Releases the lease on a claimed attraction.
+
+        Parameters
+        ----------
+        attr_ID : int
+            the id of a claimed attraction
+        """
+        self.db_cur.execute(
+            "UPDATE attractions SET lease_owner = NULL, lease_expires = NULL WHERE id = %s AND lease_owner = %s;",
+            (attr_ID, self.worker_id),
+        )
+        self.db_conn.commit()
+        self._last_heartbeat.pop(attr_ID, None)
@@ -0,0 +1,120 @@
+from time import monotonic
+
+from psycopg2.extras import execute_values
+
+from metrics import METRICS
+
+
+def _conflict_key(row):
+    # rows without a key (None) sort last instead of failing the comparison
+    return (row[0] is None, row[0])
+
+
+class BatchWriter:
+    """
+    Buffers database writes and flushes them in a single transaction.
+
+    Rows passed to add() are grouped per statement and written with execute_values,
+    raw querystrings passed to execute() are run after all buffered rows, so that
+    e.g. an attraction is only marked as scraped once its reviews are committed.
+    Functions passed to after_flush() are called once the writes buffered before them
+    are committed.
+
+    Rows are written ordered by their first column, the conflict key of the scrapers' upserts,
+    so that concurrent workers lock overlapping rows in the same order instead of deadlocking.
+    A failed flush is rolled back and keeps its buffers, so the next flush retries them.
+
+    Attributes
+    ----------
+    db_conn : psycopg2.connection()
+        a psycopg2 connection to PostgreSQL
+    batch_size : int
+        the number of buffered rows and statements that triggers a flush
+    flush_interval : float
+        the number of seconds after which buffered writes are flushed
+    """
+
+    def __init__(self, db_conn, batch_size=500, flush_interval=5.0):
+        self.db_conn = db_conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = {}
+        self._statements = []
+        self._pending = 0
+        self._callbacks = []
+        self._last_flush = monotonic()
+
+    def add(self, statement, row):
+        """
+        Buffers a row for a statement containing a single VALUES %s placeholder.
+
+        Parameters
+        ----------
+        statement : str
+            an INSERT statement of the form "INSERT INTO ... VALUES %s ..."
+        row : tuple
+            the row to be inserted
+        """
+        self._rows.setdefault(statement, []).append(row)
+        self._added()
+
+    def execute(self, querystring):
+        """
+        Buffers a querystring that is executed after all buffered rows.
+
+        Parameters
+        ----------
+        querystring : str
+            A querystring to be executed in PostgreSQL
+        """
+        self._statements.append(querystring)
+        self._added()
+
+    def after_flush(self, callback):
+        """
+        Registers a function to be called after the next successful commit.
+
+        Parameters
+        ----------
+        callback : callable
+            a function without arguments
+        """
+        self._callbacks.append(callback)
+
+    def _added(self):
+        self._pending += 1
+        if (
+            self._pending >= self.batch_size
+            or monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all buffered rows and statements and commits them.
+        """
+        if self._pending:
+            try:
+                with METRICS.time("db_flush_seconds"):
+                    with self.db_conn.cursor() as cur:
+                        for statement, rows in self._rows.items():
+                            execute_values(
+                                cur,
+                                statement,
+                                sorted(rows, key=_conflict_key),
+                                page_size=self.batch_size,
+                            )
+                        for querystring in self._statements:
+                            cur.execute(querystring)
+                    self.db_conn.commit()
+            except Exception:
+                self.db_conn.rollback()
+                raise
+            METRICS.count("rows_written", n=self._pending)
+        self._rows = {}
+        self._statements = []
+        self._pending = 0
+        self._last_flush = monotonic()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()